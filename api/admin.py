@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
-from api.models import User, Quiz, Question, Variant, Tag, Game, GeneratedQuestion, Player, Answer
+from api.models import User, Quiz, Question, Variant, Tag, Game, GeneratedQuestion, Player, Answer, ReportJob
 
 admin.site.register(User, UserAdmin)
 admin.site.register(Tag)
@@ -17,14 +17,14 @@ class QuestionInline(admin.StackedInline):
 
 @admin.register(Quiz)
 class QuizAdmin(admin.ModelAdmin):
-    fields = ('title', 'description', 'user', 'tags', 'rating', 'version_date', 'old_version')
+    fields = ('title', 'description', 'user', 'tags', 'rating', 'version_date', 'old_version', 'current_version')
     readonly_fields = ('version_date',)
-    list_display = ('title', 'description', 'user', 'rating', 'version_date', 'old_version')
+    list_display = ('title', 'description', 'user', 'rating', 'version_date', 'old_version', 'current_version')
     list_filter = ('tags', 'version_date')
     date_hierarchy = 'version_date'
     search_fields = ('title', 'description', 'tags')
     ordering = ('-version_date', '-id')
-    raw_id_fields = ('old_version', 'user',)
+    raw_id_fields = ('old_version', 'current_version', 'user',)
 
     inlines = [
         QuestionInline
@@ -96,8 +96,8 @@ class AnswerInline(admin.TabularInline):
 @admin.register(Game)
 class GameAdmin(admin.ModelAdmin):
     fields = ('label', 'quiz', 'online', 'state', 'current_question', 'user', 'organization', 'group',
-              'created_at', 'state_changed_at', 'finished_at')
-    readonly_fields = ('organization', 'created_at', 'state_changed_at', 'finished_at')
+              'created_at', 'state_changed_at', 'finished_at', 'report', 'report_updated_at')
+    readonly_fields = ('organization', 'created_at', 'state_changed_at', 'finished_at', 'report_updated_at')
     list_display = ('label', 'quiz', 'online', 'state', 'current_question', 'user', 'organization', 'group',
                     'created_at', 'state_changed_at', 'finished_at')
     list_select_related = ('quiz', 'user', 'group__organization', 'current_question')
@@ -122,12 +122,12 @@ class GameAdmin(admin.ModelAdmin):
 
 @admin.register(GeneratedQuestion)
 class GeneratedQuestionAdmin(admin.ModelAdmin):
-    fields = ('question', 'game', 'variants_order', 'started_at')
-    list_display = ('question', 'game', 'variants_order', 'started_at')
+    fields = ('question', 'game', 'number', 'variants_order', 'started_at')
+    list_display = ('question', 'game', 'number', 'variants_order', 'started_at')
     list_filter = ('game__created_at',)
     date_hierarchy = 'game__created_at'
     search_fields = ('question',)
-    ordering = ('game', 'question__number', 'id',)
+    ordering = ('game', 'number', 'id',)
     raw_id_fields = ('question', 'game')
 
     inlines = [
@@ -161,3 +161,14 @@ class AnswerAdmin(admin.ModelAdmin):
     search_fields = ('player__user', 'question')
     ordering = ('-question__game', '-question__question__number', '-question__question__id', '-answered_at', '-id')
     raw_id_fields = ('player', 'question')
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    fields = ('game', 'user', 'state', 'report', 'error', 'created_at', 'started_at', 'finished_at')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+    list_display = ('game', 'user', 'state', 'created_at', 'finished_at')
+    list_filter = ('state', 'created_at')
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at', '-id')
+    raw_id_fields = ('game', 'user')
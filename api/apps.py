@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from api.models.quiz import default_quizzes
+        # Разбираем викторины по умолчанию один раз при старте, а не при каждой регистрации
+        default_quizzes()
@@ -1,50 +1,116 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
 from channels import Group
 from channels_api import mixins, detail_action, permissions
 from channels_api.bindings import ReadOnlyResourceBinding
 from django.dispatch import receiver
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, NotFound
 
 from api.models import Game, Player, Answer, GeneratedQuestion
-from api.serializers.game import GameSerializer, PlayerSerializer, AnswerSerializer, GeneratedQuestionSerializer
+from api.serializers.game import GameSerializer, PlayerSerializer, AnswerSerializer, GeneratedQuestionSerializer, \
+    GameEventSerializer, GameFinishEventSerializer
+from api.utils.game_state import GameState
+from api.utils.scheduler import schedule
+
+
+logger = logging.getLogger(__name__)
 
 
 class GroupMixin(object):
     @classmethod
-    def broadcast(cls, action, pk=None, data=None, model=None):
+    def broadcast(cls, action, pk=None, data=None, model=None, sub=None):
+        """ Событие кодируется в JSON один раз и рассылается всей группе. """
         if model is None:
             model = cls.model
+        if sub is None:
+            sub = action
 
-        Group(cls.group_name(action, pk)).send(cls.encode(cls.stream, {
+        start = time.perf_counter()
+        message = cls.encode(cls.stream, {
             'action': action,
             'pk': pk,
             'data': data,
             'model': model.__name__
-        }))
+        })
+        logger.debug('Event "{}" of {} {} encoded in {:.2f} ms, {} bytes.'.format(
+            action, model.__name__, pk, (time.perf_counter() - start) * 1000, len(message['text'])))
+
+        Group(cls.group_name(sub, pk)).send(message)
 
     @classmethod
     def group_name(cls, action, id=None):
         return cls()._group_name(action, id=id)
 
 
+class GameEventsContext(object):
+    """
+    Контексты сериализаторов событий по играм.
+    Пользователи игроков и варианты ответов сериализуются один раз за игру, а не в каждом событии.
+    """
+
+    MAX_GAMES = 100
+
+    def __init__(self):
+        self.games = OrderedDict()
+
+    def get(self, game_id):
+        context = self.games.pop(game_id, None)
+        if context is None:
+            context = {'users': {}, 'variants': {}}
+        self.games[game_id] = context
+
+        if len(self.games) > self.MAX_GAMES:
+            self.games.popitem(last=False)
+        return context
+
+    def clear(self, game_id):
+        self.games.pop(game_id, None)
+
+
 class GameBinding(GroupMixin, mixins.SubscribeModelMixin, ReadOnlyResourceBinding):
     model = Game
     stream = "games"
     serializer_class = GameSerializer
-    queryset = Game.objects\
-        .select_related('quiz__user', 'user', 'group__organization', 'current_question')\
-        .prefetch_related('players__user',
-                          'quiz__tags',
-                          'quiz__questions',
-                          'generated_questions',
-                          'generated_questions__question',
-                          'generated_questions__players_answers',)
+    queryset = Game.objects.with_snapshot()
     permission_classes = (permissions.IsAuthenticated,)
 
+    events_context = GameEventsContext()
+
     JOIN_SUB = 'join'
     NEXT_QUESTION_SUB = 'next_question'
     ANSWER_SUB = 'answer'
     CHECK_SUB = 'check'
     FINISH_SUB = 'finish'
+    # Пачка ответов рассылается подписчикам `answer` одним событием
+    ANSWERS_BATCH = 'answers'
+    PROGRESS_SUB = 'progress'
+
+    # Подписки только для создателя игры. Игроки получают по ответам только `progress`
+    HOST_SUBS = (ANSWER_SUB,)
+
+    PROGRESS_CHANNEL = 'games.progress'
+    # Окно, за которое ответы сводятся в одно событие `progress`
+    PROGRESS_WINDOW = timedelta(seconds=1)
+
+    def serialize_data(self, instance):
+        return GameEventSerializer(instance).data
+
+    @detail_action()
+    def subscribe(self, pk, data, **kwargs):
+        """
+        Подписка на события игры. С `snapshot: true` в ответе приходит полный снапшот игры.
+        На ответы игроков (`answer`) может подписаться только создатель игры.
+        """
+        if data.get('action') in self.HOST_SUBS and not Game.objects.filter(pk=pk, user=self.user).exists():
+            raise PermissionDenied()
+
+        response, status = super().subscribe(pk, data, **kwargs)
+        if data.get('snapshot'):
+            response['snapshot'] = GameSerializer(self.get_object_or_404(pk)).data
+        return response, status
 
     @detail_action()
     def join(self, pk, data=None, **kwargs):
@@ -64,10 +130,17 @@ class GameBinding(GroupMixin, mixins.SubscribeModelMixin, ReadOnlyResourceBindin
 
     @detail_action()
     def answer(self, pk, data=None, **kwargs):
-        game = self.get_object_or_404(pk)
-        serializer = AnswerSerializer(game=game, user=self.user, data=data)
+        try:
+            game_state = GameState.load(pk)
+        except Game.DoesNotExist:
+            raise NotFound()
+
+        serializer = AnswerSerializer(game_state=game_state, user=self.user, data=data)
         serializer.is_valid(raise_exception=True)
-        answer = serializer.save()
+        if Game.ANSWERS_BATCH_WINDOW is None:
+            serializer.save()
+        else:
+            serializer.buffer()
         return serializer.data, 200
 
     @detail_action()
@@ -84,18 +157,46 @@ class GameBinding(GroupMixin, mixins.SubscribeModelMixin, ReadOnlyResourceBindin
     @staticmethod
     @receiver(Game.joined_player)
     def join_sub(sender, player, **kwargs):
-        GameBinding.broadcast(GameBinding.JOIN_SUB, pk=sender.pk, data=PlayerSerializer(player).data, model=Player)
+        context = GameBinding.events_context.get(sender.pk)
+        GameBinding.broadcast(GameBinding.JOIN_SUB, pk=sender.pk, data=PlayerSerializer(player, context=context).data,
+                              model=Player)
 
     @staticmethod
     @receiver(Game.question_changed)
     def next_question_sub(sender, **kwargs):
-        GameBinding.broadcast(GameBinding.NEXT_QUESTION_SUB, pk=sender.pk, data=GameSerializer(sender).data)
+        GameBinding.broadcast(GameBinding.NEXT_QUESTION_SUB, pk=sender.pk, data=GameEventSerializer(sender).data)
 
     @staticmethod
     @receiver(Game.answered)
-    def answer_sub(sender, answer,**kwargs):
-        GameBinding.broadcast(GameBinding.ANSWER_SUB, pk=sender.pk, data=AnswerSerializer(instance=answer).data,
-                              model=Answer)
+    def answer_sub(sender, answer, **kwargs):
+        context = GameBinding.events_context.get(sender.pk)
+        GameBinding.broadcast(GameBinding.ANSWER_SUB, pk=sender.pk,
+                              data=AnswerSerializer(instance=answer, context=context).data, model=Answer)
+        GameBinding.schedule_progress(sender.pk, answer.question_id)
+
+    @staticmethod
+    @receiver(Game.answered_batch)
+    def answers_batch_sub(sender, answers, **kwargs):
+        """ Пачка ответов уходит подписчикам `answer` одним событием `answers`. """
+        context = GameBinding.events_context.get(sender.pk)
+        GameBinding.broadcast(GameBinding.ANSWERS_BATCH, pk=sender.pk, sub=GameBinding.ANSWER_SUB,
+                              data=AnswerSerializer(instance=answers, many=True, context=context).data, model=Answer)
+        GameBinding.schedule_progress(sender.pk, answers[0].question_id)
+
+    @classmethod
+    def schedule_progress(cls, game_id, question_id):
+        """ Первый ответ в окне `PROGRESS_WINDOW` планирует событие `progress` на конец окна. """
+        if GameState.acquire_window(game_id, 'progress', cls.PROGRESS_WINDOW):
+            schedule(cls.PROGRESS_CHANNEL, {'game': game_id, 'question': question_id}, cls.PROGRESS_WINDOW)
+
+    @classmethod
+    def broadcast_progress(cls, game_id, question_id):
+        """ Сколько игроков ответило на вопрос. """
+        cls.broadcast(cls.PROGRESS_SUB, pk=game_id, model=GeneratedQuestion, data={
+            'question': question_id,
+            'answered': Answer.objects.filter(question_id=question_id).count(),
+            'players': Player.objects.filter(game_id=game_id).count(),
+        })
 
     @staticmethod
     @receiver(Game.check_signal)
@@ -106,4 +207,5 @@ class GameBinding(GroupMixin, mixins.SubscribeModelMixin, ReadOnlyResourceBindin
     @staticmethod
     @receiver(Game.finished)
     def finish_sub(sender, **kwargs):
-        GameBinding.broadcast(GameBinding.FINISH_SUB, pk=sender.pk, data=GameSerializer(sender).data)
+        GameBinding.broadcast(GameBinding.FINISH_SUB, pk=sender.pk, data=GameFinishEventSerializer(sender).data)
+        GameBinding.events_context.clear(sender.pk)
@@ -0,0 +1,54 @@
+from django.utils import timezone
+
+from api.bindings import GameBinding
+from api.models import ReportJob, Game, Quiz, User
+from api.utils.game_state import AnswersBuffer
+
+
+def generate_report(message):
+    try:
+        job = ReportJob.objects.select_related('game').get(pk=message.content['job'])
+    except ReportJob.DoesNotExist:
+        return
+
+    job.run()
+
+
+def create_default_quizzes(message):
+    user = User.objects.filter(pk=message.content['user']).first()
+    if user is not None:
+        Quiz.objects.create_default_quizzes([user])
+
+
+def flush_answers(message):
+    game_id = message.content['game']
+    answers = AnswersBuffer.pop(game_id)
+    if not answers:
+        return
+
+    try:
+        game = Game.objects.get(pk=game_id)
+    except Game.DoesNotExist:
+        return
+
+    game.answer_batch(answers)
+
+
+def touch_game(message):
+    Game.objects.filter(pk=message.content['game']).update(updated_at=timezone.now())
+
+
+def broadcast_progress(message):
+    GameBinding.broadcast_progress(message.content['game'], message.content['question'])
+
+
+def question_timeout(message):
+    """ Таймер вопроса истек: буфер ответов сохраняется и игра переходит к показу правильного ответа. """
+    game_id = message.content['game']
+
+    game = Game.objects.filter(pk=game_id).select_related('current_question__question').first()
+    if game is None:
+        return
+
+    if game.state == Game.ANSWERING_STATE and game.current_question_id == message.content['question']:
+        game.check_state()
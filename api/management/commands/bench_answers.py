@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from api.models import User, Quiz, Game
+
+
+class Command(BaseCommand):
+    help = 'Замеряет скорость сохранения ответов: по одному (Game.answer) и пачкой (Game.answer_batch). ' \
+           'Данные создаются в транзакции, которая откатывается.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players_cnt', dest='players_cnt', type=int, default=200)
+        parser.add_argument('--batch_size', dest='batch_size', type=int, default=50,
+                            help='Количество ответов, накопленных за окно буфера.')
+        parser.add_argument('--scoring', dest='scoring', choices=(Game.FIXED_SCORING, Game.SPEED_SCORING),
+                            default=Game.FIXED_SCORING)
+
+    @transaction.atomic
+    def handle(self, players_cnt, batch_size, scoring, *args, **options):
+        owner = User.objects.create_user('bench_answers_owner')
+        questions = [{
+            'type': 'single',
+            'question': 'Question {}'.format(number),
+            'variants': [{'variant': 'Correct'}, {'variant': 'Incorrect'}],
+            'answer': [1],
+            'timer': timedelta(seconds=20),
+            'points': 10,
+        } for number in (1, 2)]
+        quiz = Quiz.objects.create_quiz(title='Bench', user=owner, questions=questions)
+        game = Game.objects.new_game(quiz, owner, scoring=scoring)
+
+        players = [game.join(User.objects.create_user('bench_answers_player_{}'.format(i)))
+                   for i in range(players_cnt)]
+        game.next_question()
+        first_question, second_question = game.generated_questions.select_related('question')\
+            .order_by('number')
+
+        count = 100000
+        start = time.perf_counter()
+        for _ in range(count):
+            Game.count_points(first_question, True, scoring)
+        print('Подсчет очков ({}): {:.2f} мкс'.format(scoring, (time.perf_counter() - start) / count * 10 ** 6))
+
+        start = time.perf_counter()
+        for player in players:
+            game.answer(player, first_question.answer, first_question)
+        single = time.perf_counter() - start
+
+        answers = [{'player': player.pk, 'question': second_question.pk, 'answer': second_question.answer}
+                   for player in players]
+        start = time.perf_counter()
+        for i in range(0, len(answers), batch_size):
+            game.answer_batch(answers[i:i + batch_size])
+        batch = time.perf_counter() - start
+
+        print('По одному: {:.0f} ответов/сек'.format(players_cnt / single))
+        print('Пачками по {}: {:.0f} ответов/сек'.format(batch_size, players_cnt / batch))
+
+        transaction.set_rollback(True)
@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db import transaction, connection
+from django.test.utils import CaptureQueriesContext
+
+from api.models import User, Quiz
+
+
+class Command(BaseCommand):
+    help = 'Замеряет создание викторин с разным количеством вопросов (Quiz.objects.create_quiz) ' \
+           'и их копирование пользователям (Quiz.objects.bulk_copy). ' \
+           'Данные создаются в транзакции, которая откатывается.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', dest='sizes', type=int, nargs='+', default=[10, 100, 1000],
+                            help='Количество вопросов в викторине.')
+        parser.add_argument('--variants_cnt', dest='variants_cnt', type=int, default=4)
+        parser.add_argument('--users_cnt', dest='users_cnt', type=int, default=100,
+                            help='Количество пользователей, которым копируется каждая викторина.')
+
+    @transaction.atomic
+    def handle(self, sizes, variants_cnt, users_cnt, *args, **options):
+        owner = User.objects.create_user('bench_quizzes_owner')
+        users = [User.objects.create_user('bench_quizzes_user_{}'.format(i)) for i in range(users_cnt)]
+
+        for size in sizes:
+            questions = [{
+                'type': 'single',
+                'question': 'Question {}'.format(number),
+                'variants': [{'variant': 'Variant {}'.format(i)} for i in range(1, variants_cnt + 1)],
+                'answer': [1],
+                'timer': timedelta(seconds=20),
+                'points': 10,
+            } for number in range(1, size + 1)]
+
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                quiz = Quiz.objects.create_quiz(title='Bench {}'.format(size), user=owner, questions=questions)
+                elapsed = time.perf_counter() - start
+            print('{} вопросов: {:.1f} мс, {} запросов'.format(size, elapsed * 1000, len(context.captured_queries)))
+
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                Quiz.objects.bulk_copy([quiz], users)
+                elapsed = time.perf_counter() - start
+            print('  копирование {} пользователям: {:.1f} мс, {} запросов'.format(
+                users_cnt, elapsed * 1000, len(context.captured_queries)))
+
+        transaction.set_rollback(True)
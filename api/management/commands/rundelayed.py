@@ -0,0 +1,19 @@
+import time
+
+from django.core.management import BaseCommand
+
+from api.utils.scheduler import send_due_messages
+
+
+class Command(BaseCommand):
+    help = 'Отправляет в каналы отложенные сообщения (таймеры вопросов, сброс буфера ответов и т.д.)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', dest='interval', type=int, default=20,
+                            help='Пауза между проверками очереди в миллисекундах.')
+
+    def handle(self, interval, *args, **options):
+        self.stdout.write('Отправка отложенных сообщений...')
+        while True:
+            if not send_due_messages():
+                time.sleep(interval / 1000)
@@ -8,6 +8,9 @@ from api.models import User, Quiz, Game
 from organization.models import Organization, Group, GroupMember
 
 
+GAMES_CHUNK_SIZE = 100
+
+
 def random_word(length):
     letters = string.ascii_lowercase
     return ''.join(random.sample(letters, length))
@@ -73,13 +76,15 @@ class Command(BaseCommand):
                 print('Ошибка при добавлении {} в группу {}'.format(user, group))
 
         print('\nСоздаю {} новых игр...'.format(games_cnt))
-        for i in range(games_cnt):
+        groups = list(Group.objects.all())
+        for i in range(0, games_cnt, GAMES_CHUNK_SIZE):
             quiz = Quiz.objects.all().order_by('?').first()
-            group = Group.objects.order_by('?').first()
-            label = 'Test game #{}'.format(i)
+            chunk_groups = [random.choice(groups) if groups else None
+                            for _ in range(min(GAMES_CHUNK_SIZE, games_cnt - i))]
+            label = 'Test games #{}'.format(i // GAMES_CHUNK_SIZE)
             try:
-                game = Game.objects.new_game(quiz, quiz.user, label, False, group)
-                print('{}/{} Создана новая игра {}'.format(i + 1, games_cnt, game))
+                games = Game.objects.new_games(quiz, quiz.user, chunk_groups, label, False)
+                print('{}/{} Созданы новые игры викторины {}'.format(i + len(games), games_cnt, quiz))
             except Exception:
                 traceback.print_exc()
                 print('Ошибка при добавлении {}'.format(label))
@@ -0,0 +1,24 @@
+# Generated by Django 2.1.1 on 2026-10-18 12:22
+
+import api.models.game
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_game_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='report',
+            field=models.FileField(blank=True, help_text='Сохраненный отчет завершенной игры.', null=True, upload_to=api.models.game.report_path, verbose_name='Отчет'),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='report_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Время генерации отчета'),
+        ),
+    ]
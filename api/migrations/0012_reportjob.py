@@ -0,0 +1,34 @@
+# Generated by Django 2.1.1 on 2026-10-18 13:05
+
+import api.models.game
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_game_report'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('queued', 'В очереди'), ('processing', 'Генерируется'), ('done', 'Готов'), ('failed', 'Ошибка')], db_index=True, default='queued', max_length=15, verbose_name='Состояние')),
+                ('report', models.FileField(blank=True, null=True, upload_to=api.models.game.report_path, verbose_name='Отчет')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Время начала генерации')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Время завершения генерации')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to='api.Game', verbose_name='Игра')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Инициатор')),
+            ],
+            options={
+                'verbose_name': 'Задача генерации отчета',
+                'verbose_name_plural': 'Задачи генерации отчетов',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_reportjob'),
+    ]
+
+    operations = [
+        # Перед добавлением ограничения оставляем только последний ответ игрока на вопрос
+        migrations.RunSQL(
+            """
+            DELETE FROM api_answer a
+            USING api_answer b
+            WHERE a.player_id = b.player_id AND a.question_id = b.question_id AND
+                  (a.answered_at < b.answered_at OR (a.answered_at = b.answered_at AND a.id < b.id))
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='answer',
+            unique_together={('player', 'question')},
+        ),
+    ]
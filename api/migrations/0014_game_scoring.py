@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_answer_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='scoring',
+            field=models.CharField(choices=[('fixed', 'Фиксированные очки за вопрос'), ('speed', 'Очки зависят от скорости ответа')], default='fixed', help_text='При speed за правильный ответ начисляется от половины до всех очков вопроса в зависимости от того, сколько времени таймера прошло.', max_length=15, verbose_name='Подсчет очков'),
+        ),
+    ]
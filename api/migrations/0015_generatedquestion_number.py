@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_game_scoring'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedquestion',
+            name='number',
+            field=models.PositiveIntegerField(default=0, help_text='Номер вопроса в викторине на момент создания игры.', verbose_name='Номер вопроса'),
+        ),
+        migrations.RunSQL(
+            'UPDATE api_generatedquestion SET number = api_question.number '
+            'FROM api_question WHERE api_question.id = api_generatedquestion.question_id',
+            migrations.RunSQL.noop
+        ),
+        migrations.AddIndex(
+            model_name='generatedquestion',
+            index=models.Index(fields=['game', 'number'], name='api_generat_game_id_2466a6_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+import api.models.report
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reportjob',
+            name='report',
+            field=models.FileField(blank=True, null=True, upload_to=api.models.report.job_report_path,
+                                   verbose_name='Отчет'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_reportjob_report_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='current_version',
+            field=models.ForeignKey(blank=True, help_text='Заполнено у архивных версий, на которые ссылаются сыгранные игры.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_versions', to='api.Quiz', verbose_name='Текущая версия'),
+        ),
+    ]
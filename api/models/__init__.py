@@ -9,3 +9,5 @@ from api.models.game import Game
 from api.models.game import GeneratedQuestion
 from api.models.game import Player
 from api.models.game import Answer
+
+from api.models.report import ReportJob
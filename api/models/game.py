@@ -1,42 +1,112 @@
-import io
 import random
+from collections import OrderedDict
+from datetime import timedelta, datetime
+from itertools import chain
 
-import xlsxwriter
 from django.contrib.postgres.fields import ArrayField
-from django.db import models, transaction
-from django.db.models import Sum
+from django.core.files import File
+from django.db import models, transaction, connection
+from django.db.models import Sum, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.db.models.signals import post_save
 from django.dispatch import Signal, receiver
 from django.utils import timezone
+from django.utils.timezone import utc
 from rest_framework.exceptions import ValidationError
 
 from api.models import Quiz, User, Question, Variant
-from api.utils.xlsx import XslStyles
 from organization.models import Group
 
 
-class GameManager(models.Manager):
+class GameQuerySet(models.QuerySet):
+    # Связи, которые читает `GameSerializer`: путь поля сериализатора -> что загрузить
+    SNAPSHOT_SELECT_RELATED = OrderedDict((
+        ('quiz', ('quiz',)),
+        ('quiz.user', ('quiz__user',)),
+        ('user', ('user',)),
+        ('group', ('group__organization',)),
+        ('current_question', ('current_question__question',)),
+    ))
+    SNAPSHOT_PREFETCH_RELATED = OrderedDict((
+        ('players', ('players__user',)),
+        ('quiz.tags', ('quiz__tags',)),
+        ('quiz.questions', ('quiz__questions__variants',)),
+        ('current_question.variants', ('current_question__question__variants',)),
+        ('generated_questions', ('generated_questions__question',)),
+        ('generated_questions.variants', ('generated_questions__question__variants',)),
+        ('generated_questions.players_answers', ('generated_questions__question__variants',
+                                                 'generated_questions__players_answers__player__user')),
+    ))
+
+    def with_snapshot(self):
+        """ Игры со всем, что нужно `GameSerializer`. Число запросов не зависит от количества игр и их размера. """
+        return self\
+            .select_related(*chain.from_iterable(self.SNAPSHOT_SELECT_RELATED.values()))\
+            .prefetch_related(*OrderedDict.fromkeys(chain.from_iterable(self.SNAPSHOT_PREFETCH_RELATED.values())))
+
+    def with_counts(self):
+        """
+        Игры для списков: без вложенных вопросов и ответов, с количеством игроков и вопросов.
+        Количества считаются коррелированными подзапросами, а не JOIN, чтобы не перемножать игроков на вопросы.
+        """
+        return self\
+            .select_related('quiz', 'user', 'group__organization')\
+            .annotate(players_count=self.count_subquery(Player), questions_count=self.count_subquery(GeneratedQuestion))
+
+    @staticmethod
+    def count_subquery(model):
+        queryset = model.objects.filter(game=OuterRef('pk')).order_by().values('game')\
+            .annotate(count=Count('pk')).values('count')
+        return Coalesce(Subquery(queryset, output_field=models.IntegerField()), 0)
+
+
+class GameManager(models.Manager.from_queryset(GameQuerySet)):
     @transaction.atomic
-    def new_game(self, quiz, user, label='', online=False, group=None):
-        game = self.create(quiz=quiz, label=label, online=online, user=user, group=group)
+    def new_game(self, quiz, user, label='', online=False, group=None, scoring=None):
+        game = self.create(quiz=quiz, label=label, online=online, user=user, group=group,
+                           scoring=scoring or Game.FIXED_SCORING)
 
-        for question in quiz.questions.all():
-            GeneratedQuestion.objects.generate(game, question)
+        GeneratedQuestion.objects.bulk_generate([game], quiz.questions.prefetch_related('variants'))
 
         if group is not None:
-            group.organization.quizzes.add(quiz)
+            quiz.organization_set.add(group.organization_id)
 
         return game
 
+    @transaction.atomic
+    def new_games(self, quiz, user, groups, label='', online=False, scoring=None):
+        """
+        Запуск одной викторины сразу для нескольких групп.
+        Игры и их вопросы создаются через `bulk_create`, поэтому сигналы `post_save` для них не отправляются.
+        """
+        games = self.bulk_create([
+            self.model(quiz=quiz, label=label, online=online, user=user, group=group,
+                       scoring=scoring or Game.FIXED_SCORING)
+            for group in groups
+        ])
+
+        GeneratedQuestion.objects.bulk_generate(games, quiz.questions.prefetch_related('variants'))
+
+        organizations = {group.organization_id for group in groups if group is not None}
+        if organizations:
+            quiz.organization_set.add(*organizations)
+
+        return games
+
 
 def report_path(instance, filename):
-    return 'reports/%Y/%m/%d/Game_{}_%Y-%m-%d_%H-%M.xlsx'.format(instance.pk)
+    return timezone.now().strftime('reports/%Y/%m/%d/Game_{}_%Y-%m-%d_%H-%M.xlsx').format(instance.pk)
 
 
 class Game(models.Model):
     class Meta:
         verbose_name = 'Игра'
         verbose_name_plural = 'Игры'
+        # Для курсорной пагинации списков игр
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['user', '-created_at', '-id']),
+        ]
 
     quiz = models.ForeignKey(Quiz, verbose_name='Викторина',  on_delete=models.CASCADE)
     label = models.CharField(max_length=300, verbose_name='Название', blank=True)
@@ -65,11 +135,23 @@ class Game(models.Model):
 
     current_question = models.ForeignKey('GeneratedQuestion', verbose_name='Текущий вопрос', on_delete=models.CASCADE,
                                          null=True, related_name='+')
+    FIXED_SCORING = 'fixed'
+    SPEED_SCORING = 'speed'
+    SCORING_CHOICES = (
+        (FIXED_SCORING, 'Фиксированные очки за вопрос'),
+        (SPEED_SCORING, 'Очки зависят от скорости ответа'),
+    )
+    scoring = models.CharField(max_length=15, verbose_name='Подсчет очков', choices=SCORING_CHOICES,
+                               default=FIXED_SCORING,
+                               help_text='При speed за правильный ответ начисляется от половины до всех очков вопроса '
+                                         'в зависимости от того, сколько времени таймера прошло.')
+
     timer_on = models.BooleanField(default=True, verbose_name='Включен ли таймер?',
                                    help_text='При true текущий вопрос ограничен по времени.', db_index=True)
 
-    # TODO: Saving report
-    # report = models.FileField(null=True, upload_to=report_path)
+    report = models.FileField(null=True, blank=True, upload_to=report_path, verbose_name='Отчет',
+                              help_text='Сохраненный отчет завершенной игры.')
+    report_updated_at = models.DateTimeField(null=True, blank=True, verbose_name='Время генерации отчета')
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Время изменения', db_index=True,
@@ -85,23 +167,43 @@ class Game(models.Model):
     joined_player = Signal(providing_args=['player'])
     question_changed = Signal()
     answered = Signal(providing_args=['answer'])
+    answered_batch = Signal(providing_args=['answers'])
     check_signal = Signal(providing_args=['question'])
     finished = Signal()
 
     CAN_JOIN_TO_GOING_GAME = True
+    # Канал, в который по истечении таймера вопроса приходит сообщение для перехода в CHECK_STATE
+    TIMER_CHANNEL = 'games.timer'
+    # Канал отложенного обновления `updated_at` в конце окна `ANSWERS_TOUCH_WINDOW`
+    TOUCH_CHANNEL = 'games.touch'
+    # Окно, в течение которого ответы игроков обновляют `updated_at` не больше одного раза
+    ANSWERS_TOUCH_WINDOW = timedelta(seconds=1)
+    # Окно, за которое ответы по websocket копятся в буфере и сохраняются одной пачкой.
+    # При None каждый ответ сохраняется сразу.
+    ANSWERS_BATCH_WINDOW = timedelta(milliseconds=150)
 
     @property
-    def timer(self):
-        if self.current_question is None:
+    def deadline(self):
+        """ Время окончания приема ответов на текущий вопрос или None, если вопрос не ограничен по времени. """
+        if self.state != self.ANSWERING_STATE or not self.timer_on or self.current_question is None:
             return None
 
         timer = self.current_question.question.timer
         if timer is None:
             return None
 
-        return timezone.now() - self.state_changed_at - timer
+        return self.state_changed_at + timer
+
+    @property
+    def timer(self):
+        deadline = self.deadline
+        if deadline is None:
+            return None
+
+        return max(deadline - timezone.now(), timedelta(0))
 
     def finish(self):
+        self.flush_answers()
         now = timezone.now()
 
         self.current_question = None
@@ -129,6 +231,7 @@ class Game(models.Model):
         if self.state == self.FINISH_STATE:
             return self.current_question    # None
 
+        self.flush_answers()
         now = timezone.now()
 
         try:
@@ -152,24 +255,90 @@ class Game(models.Model):
         if question is None:
             question = self.current_question
 
-        correct = question.answer == answer
-        points = self.count_points(question, correct)
-
-        player_answer, created = Answer.objects.update_or_create(
-            question=question,
-            player=player,
-            defaults={'answer': answer, 'correct': correct, 'points': points}
-        )
-
-        self.save()
+        player_answer = self.make_answer(player, question, answer)
+        self.save_answers([player_answer])
 
         self.answered.send(self, answer=player_answer)
         return player_answer
 
+    def answer_batch(self, answers):
+        """
+        Пачка ответов игроков из буфера: [{'player': id, 'question': id, 'answer': [...], 'answered_at': ts}, ...].
+        Все ответы сохраняются одним upsert, подписчикам уходит одно событие со всеми ответами.
+        """
+        # Повторный ответ игрока на тот же вопрос заменяет предыдущий
+        answers = {(answer['player'], answer['question']): answer for answer in answers}
+        players = self.players.select_related('user').in_bulk({player for player, question in answers})
+        questions = self.generated_questions.select_related('question')\
+            .in_bulk({question for player, question in answers})
+
+        players_answers = [
+            self.make_answer(players[player], questions[question], answer['answer'],
+                             answered_at=datetime.fromtimestamp(answer['answered_at'], utc)
+                             if answer.get('answered_at') is not None else None)
+            for (player, question), answer in answers.items()
+            if player in players and question in questions
+        ]
+        if not players_answers:
+            return []
+
+        self.save_answers(players_answers)
+
+        self.answered_batch.send(self, answers=players_answers)
+        return players_answers
+
+    def flush_answers(self):
+        """ Сохраняет ответы из буфера. Вызывается перед сменой состояния, чтобы ответы окна не потерялись. """
+        from api.utils.game_state import AnswersBuffer
+        answers = AnswersBuffer.pop(self.pk)
+        if answers:
+            self.answer_batch(answers)
+
+    def make_answer(self, player, question, answer, answered_at=None):
+        if answered_at is None:
+            answered_at = timezone.now()
+
+        correct = question.answer == answer
+        return Answer(player=player, question=question, answer=answer, correct=correct, answered_at=answered_at,
+                      points=self.count_points(question, correct, self.scoring, answered_at))
+
+    def save_answers(self, answers):
+        """
+        Ответы сохраняются одним upsert, рейтинги игроков и пользователей увеличиваются на разницу очков
+        одним запросом. Строка игры не блокируется: `updated_at` обновляется не чаще раза в `ANSWERS_TOUCH_WINDOW`.
+        """
+        with transaction.atomic():
+            deltas = Answer.objects.bulk_upsert(answers)
+            Player.objects.add_ratings(deltas)
+
+        players = {answer.player_id: answer.player for answer in answers}
+        for player_id, delta in deltas.items():
+            player = players[player_id]
+            player.rating += delta
+            if Player.user.is_cached(player):
+                player.user.rating += delta
+
+        self.touch()
+
+    def touch(self):
+        """
+        Обновляет `updated_at` без сохранения всей игры, не чаще раза в `ANSWERS_TOUCH_WINDOW`.
+        Вызовы внутри окна планируют одно обновление на его конец, чтобы последний ответ не терялся.
+        """
+        from api.utils.game_state import GameState
+        from api.utils.scheduler import schedule
+
+        if GameState.acquire_window(self.pk, 'touch', self.ANSWERS_TOUCH_WINDOW):
+            self.updated_at = timezone.now()
+            Game.objects.filter(pk=self.pk).update(updated_at=self.updated_at)
+        elif GameState.acquire_window(self.pk, 'touch_trailing', self.ANSWERS_TOUCH_WINDOW):
+            schedule(self.TOUCH_CHANNEL, {'game': self.pk}, self.ANSWERS_TOUCH_WINDOW)
+
     def check_state(self):
         if self.state != self.ANSWERING_STATE:
             raise ValidationError('Now not answering state', code='not_answering')
 
+        self.flush_answers()
         self.state = self.CHECK_STATE
         self.save()
 
@@ -178,192 +347,111 @@ class Game(models.Model):
         return self.current_question
 
     def make_report(self):
-        output = io.BytesIO()
-        report = xlsxwriter.Workbook(output)
-        styles = XslStyles(report)
-
-        self.report_main_page(report, styles)
-        self.report_answers_page(report, styles)
-
-        report.close()
-        output.seek(0)
-        return output
-
-    def report_main_page(self, report, styles):
-        worksheet = report.add_worksheet('Общее')
-
-        worksheet.set_column('A:A', 30)
-        worksheet.set_column('B:B', 50)
-
-        worksheet.write('A1', 'Отчет по проведенной викторине № {} за {}'.format(
-            self.pk, self.updated_at.now().strftime('%Y-%m-%d %H:%M')), styles.title)
-        worksheet.set_row(0, 30)
-        worksheet.write('A2', self.label)
-
-        worksheet.write('A3', 'Дата:', styles.bold)
-        worksheet.write('B3', self.updated_at.now().strftime('%Y-%m-%d %H:%M'))
-
-        worksheet.write('A4', 'Организация:', styles.bold)
-        worksheet.write('B4', self.group.organization.name if self.group is not None else '-')
-
-        worksheet.write('A5', 'Группа:', styles.bold)
-        worksheet.write('B5', self.group.name if self.group is not None else '-')
-
-        worksheet.write('A7', 'Количество участников:', styles.bold)
-        players_count = self.players.all().count()
-        worksheet.write_number('B7', players_count)
-
-        worksheet.write('A8', 'Процент правильных ответов:', styles.bold)
-        success_answers_count = Answer.objects.filter(question__game=self, correct=True).count()
-        questions_count = self.generated_questions.all().count()
-        answers_count = players_count * questions_count
-        if answers_count == 0:
-            answers_count = 1
-        worksheet.write_number('B8', success_answers_count / answers_count * 100)
-
-    def report_answers_page(self, report, styles):
-        worksheet = report.add_worksheet('Ответы участников')
-
-        players = self.players.all().order_by('user__last_name', 'user__first_name', 'user__patronymic',
-                                              'user__username')
-        players_count = players.count()
-        questions = self.generated_questions.order_by('question__number')
-
-        player_header_row = 5
-        question_total_row = player_header_row + players_count + 1
-
-        self.report_questions(worksheet, styles, questions, 3, question_total_row)
-        self.report_players_answers(worksheet, styles, players, questions, player_header_row)
-
-    def report_questions(self, worksheet, styles, questions, data_start_col, total_row):
-        question_num_row = 0
-        worksheet.write(question_num_row, 0, '№ вопроса:', styles.bold)
-        question_text_row = 1
-        worksheet.write(question_text_row, 0, 'Вопрос:', styles.bold)
-        variants_row = 2
-        worksheet.write(variants_row, 0, 'Варианты:', styles.bold)
-        answer_row = 3
-        worksheet.write(answer_row, 0, 'Ответ:', styles.bold)
-        points_row = 4
-        worksheet.write(points_row, 0, 'Макс. балл за правильный ответ:', styles.bold)
-
-        questions_count = questions.count()
-        players_count = self.players.all().count()
-
-        success_answers_count_row = total_row
-        worksheet.write(success_answers_count_row, 0, 'Количество правильных ответов:', styles.bold)
-        answers_count_row = success_answers_count_row + 1
-        worksheet.write(answers_count_row, 0, 'Количество ответов:', styles.bold)
-        success_answers_percent_row = answers_count_row + 1
-        worksheet.write(success_answers_percent_row, 0, 'Процент правильных ответов:', styles.bold)
-
-        # Заполняю вопросы
-        for col, question in enumerate(questions, data_start_col):
-            worksheet.write_number(question_num_row, col, question.number, styles.bold)
-            worksheet.write(question_text_row, col, question.question.question)
-            worksheet.write(variants_row, col, question.variants_str)
-            worksheet.write(answer_row, col, question.question.answer_str)
-            worksheet.write_number(points_row, col, question.question.points)
-
-            success_answers_count = Answer.objects.filter(question=question, correct=True).count()
-            worksheet.write_number(success_answers_count_row, col, success_answers_count)
-            answers_count = Answer.objects.filter(question=question).count()
-            worksheet.write_number(answers_count_row, col, answers_count)
-            success_answers_percent = success_answers_count / players_count * 100 if players_count > 0 else 0
-            worksheet.write_number(success_answers_percent_row, col, success_answers_percent)
-
-        worksheet.set_column(data_start_col, data_start_col + questions_count - 1, 20)
-
-    def report_players_answers(self, worksheet, styles, players, questions, player_header_row):
-        questions_count = questions.count()
-
-        index_col = 0
-        worksheet.write(player_header_row, index_col, '№', styles.bold)
-        login_col = 1
-        worksheet.write(player_header_row, login_col, 'Логин', styles.bold)
-        name_col = 2
-        worksheet.write(player_header_row, name_col, 'ФИО', styles.bold)
-        worksheet.set_column(name_col, name_col, 30)
-        data_start_col = name_col + 1
-
-        success_answers_count_col = data_start_col + questions_count
-        worksheet.write(player_header_row, success_answers_count_col, 'Кол-во правильных ответов', styles.bold)
-        worksheet.set_column(success_answers_count_col, success_answers_count_col, 15)
-
-        success_answers_percent_col = success_answers_count_col + 1
-        worksheet.write(player_header_row, success_answers_percent_col, 'Процент правильных ответов', styles.bold)
-        worksheet.set_column(success_answers_percent_col, success_answers_percent_col, 15)
-
-        rating_col = success_answers_percent_col + 1
-        worksheet.write(player_header_row, rating_col, 'Рейтинг', styles.bold)
-
-        # Заполняю ответы
-        row = player_header_row + 1
-        for i, player in enumerate(players, 1):
-            worksheet.write_number(row, index_col, i)
-            worksheet.write(row, login_col, player.user.username)
-            worksheet.write(row, name_col, player.user.full_name)
-
-            for col, question in enumerate(questions, data_start_col):
-                try:
-                    answer = Answer.objects.get(player=player, question=question)
-                    style = styles.bg_green if answer.correct else styles.bg_red
-                    worksheet.write(row, col, answer.answer_str, style)
-                except Answer.DoesNotExist:
-                    worksheet.write(row, col, '-', styles.bg_gray)
-
-            success_answers_count = Answer.objects.filter(player=player, correct=True).count()
-            worksheet.write_number(row, success_answers_count_col, success_answers_count)
-            success_answers_percent = success_answers_count / questions_count * 100
-            worksheet.write_number(row, success_answers_percent_col, success_answers_percent)
-            worksheet.write_number(row, rating_col, player.rating)
-
-            row += 1
+        from api.utils.reports import GameReport
+        return GameReport(self).make()
+
+    def make_report_file(self):
+        from api.utils.reports import GameReport
+        return GameReport(self).make_file()
+
+    @property
+    def report_is_actual(self):
+        return bool(self.report) and self.report_updated_at is not None and self.report_updated_at >= self.updated_at
+
+    def save_report(self):
+        """
+        Генерирует отчет и сохраняет его в MEDIA_ROOT. Снапшот игры (`updated_at`) при этом не меняется.
+        Прошлый файл удаляется, только если его не отдает ни одна задача генерации отчета.
+        """
+        if self.report and not self.report_jobs.filter(report=self.report.name).exists():
+            self.report.delete(save=False)
+
+        with self.make_report_file() as report:
+            self.report.save(self.report_filename, File(report), save=False)
+        self.report_updated_at = timezone.now()
+
+        Game.objects.filter(pk=self.pk).update(report=self.report.name, report_updated_at=self.report_updated_at)
+        return self.report
+
+    @property
+    def report_name(self):
+        return 'Game_{}__{}'.format(self.pk, self.updated_at.strftime('%Y-%m-%d_%H-%M'))
 
     @property
     def report_filename(self):
-        return 'Game_{}__{}.xlsx'.format(self.pk, self.updated_at.strftime('%Y-%m-%d_%H-%M'))
+        return '{}.xlsx'.format(self.report_name)
 
     @property
     def players_rating(self):
         return self.players.order_by('-rating', 'id')
 
     @staticmethod
-    def count_points(generated_question, correct=True):
+    def count_points(generated_question, correct=True, scoring=FIXED_SCORING, answered_at=None):
+        """
+        Очки за ответ. Считаются только по уже загруженному вопросу, без запросов к БД.
+        При `SPEED_SCORING` мгновенный ответ получает все очки вопроса, ответ в конце таймера - половину.
+        """
         if not correct:
             return 0
 
-        # Очки зависят от скорости ответа
-        # timer = generated_question.question.timer
-        # coefficient = (timezone.now() - generated_question.started_at) / timer if timer is not None else 1
-        # if coefficient < 0:
-        #     coefficient = 0
-        # return generated_question.question.points + generated_question.question.points * coefficient
+        points = generated_question.question.points
+        timer = generated_question.question.timer
+        if scoring != Game.SPEED_SCORING or not timer or generated_question.started_at is None:
+            return points
 
-        return generated_question.question.points
+        if answered_at is None:
+            answered_at = timezone.now()
+        elapsed = min(max(answered_at - generated_question.started_at, timedelta(0)), timer)
+        return round(points * (1 - elapsed / timer / 2))
 
     def __str__(self):
         return '{} {}'.format(self.label, self.quiz)
 
 
-class GeneratedQuestionManager(models.Manager):
+class GeneratedQuestionQuerySet(models.QuerySet):
+    def first_by_number(self):
+        """ Первый по номеру вопрос (индекс `(game, number)`). Если вопросов нет, бросает `DoesNotExist`. """
+        question = self.order_by('number').first()
+        if question is None:
+            raise self.model.DoesNotExist()
+        return question
+
+
+class GeneratedQuestionManager(models.Manager.from_queryset(GeneratedQuestionQuerySet)):
     def generate(self, game, question):
         variants_order = list(map(lambda variant: variant.pk, question.variants.all()))
         random.shuffle(variants_order)
-        return self.create(game=game, question=question, variants_order=variants_order)
+        return self.create(game=game, question=question, number=question.number, variants_order=variants_order)
+
+    def bulk_generate(self, games, questions):
+        """ Вопросы для игр одним INSERT. Варианты вопросов должны быть предзагружены (`prefetch_related`). """
+        questions = list(questions)
+        generated_questions = []
+        for game in games:
+            for question in questions:
+                variants_order = [variant.pk for variant in question.variants.all()]
+                random.shuffle(variants_order)
+                generated_questions.append(self.model(game=game, question=question, number=question.number,
+                                                      variants_order=variants_order))
+        return self.bulk_create(generated_questions)
 
     @property
     def first_question(self):
-        return self.get(question__number=1)
+        return self.first_by_number()
 
 
 class GeneratedQuestion(models.Model):
     class Meta:
         verbose_name = 'Сгенерированный вопрос'
         verbose_name_plural = 'Сгенерированные вопросы'
+        indexes = [
+            models.Index(fields=['game', 'number']),
+        ]
 
     game = models.ForeignKey(Game, verbose_name='Игра', on_delete=models.CASCADE, related_name='generated_questions')
     question = models.ForeignKey(Question, verbose_name='Вопрос', on_delete=models.CASCADE)
+    number = models.PositiveIntegerField(verbose_name='Номер вопроса', default=0,
+                                         help_text='Номер вопроса в викторине на момент создания игры.')
     variants_order = ArrayField(
         models.IntegerField(), verbose_name='Порядок вариантов',
         help_text='ID вариантов. При создании новой игры варианты перемешиваются.',
@@ -373,10 +461,6 @@ class GeneratedQuestion(models.Model):
 
     objects = GeneratedQuestionManager()
 
-    @property
-    def number(self):
-        return self.question.number
-
     @property
     def type(self):
         return self.question.type
@@ -395,11 +479,13 @@ class GeneratedQuestion(models.Model):
 
     @property
     def next(self):
-        return GeneratedQuestion.objects.get(game=self.game, question__number=self.number + 1)
+        return GeneratedQuestion.objects.filter(game_id=self.game_id, number__gt=self.number).first_by_number()
 
     @property
     def variants(self):
-        return list(map(lambda variant_id: self.question.variants.get(id=variant_id), self.variants_order))
+        """ Варианты в порядке `variants_order`. Используют предзагруженные `question__variants`. """
+        variants = {variant.pk: variant for variant in self.question.variants.all()}
+        return [variants[variant_id] for variant_id in self.variants_order if variant_id in variants]
 
     @property
     def variants_str(self):
@@ -410,6 +496,29 @@ class GeneratedQuestion(models.Model):
         return str(self.question)
 
 
+class PlayerManager(models.Manager):
+    def add_ratings(self, deltas):
+        """ Увеличивает рейтинг игроков и их пользователей одним запросом: {player_id: delta}. """
+        deltas = [(player_id, delta) for player_id, delta in deltas.items() if delta]
+        if not deltas:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                WITH delta (id, value) AS (VALUES {values}),
+                players AS (
+                    UPDATE {players} SET rating = {players}.rating + delta.value
+                    FROM delta WHERE {players}.id = delta.id
+                    RETURNING {players}.user_id, delta.value
+                )
+                UPDATE {users} SET rating = {users}.rating + users_delta.value
+                FROM (SELECT user_id, SUM(value) AS value FROM players GROUP BY user_id) users_delta
+                WHERE {users}.id = users_delta.user_id
+            '''.format(values=', '.join(['(%s, %s)'] * len(deltas)),
+                       players=self.model._meta.db_table, users=User._meta.db_table),
+                [param for delta in deltas for param in delta])
+
+
 class Player(models.Model):
     user = models.ForeignKey(User, verbose_name='Пользователь', related_name='players', on_delete=models.CASCADE)
     game = models.ForeignKey(Game, verbose_name='Игра', on_delete=models.CASCADE, related_name='players')
@@ -417,6 +526,8 @@ class Player(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время присоединения')
     finished_at = models.DateTimeField(verbose_name='Время завершения игры', null=True, db_index=True)
 
+    objects = PlayerManager()
+
     class Meta:
         verbose_name = 'Игрок'
         verbose_name_plural = 'Игроки'
@@ -430,10 +541,75 @@ class Player(models.Model):
         return str(self.user)
 
 
+class AnswerManager(models.Manager):
+    @transaction.atomic
+    def bulk_upsert(self, answers):
+        """
+        Создает или заменяет ответы игроков, ответам проставляются id.
+        Возвращает изменение очков игроков: {player_id: delta}.
+
+        Сначала новые ответы вставляются с ON CONFLICT DO NOTHING, затем уже существующие ответы
+        блокируются (FOR UPDATE) и обновляются. Старые очки читаются из заблокированной строки,
+        поэтому ответ, параллельно сохраненный другой транзакцией, не учитывается в рейтинге дважды.
+        """
+        for answer in answers:
+            if answer.answered_at is None:
+                answer.answered_at = timezone.now()
+        # Строки блокируются в одном порядке, чтобы параллельные пачки не ждали друг друга по кругу
+        answers = sorted(answers, key=lambda answer: (answer.player_id, answer.question_id))
+
+        def values(answers):
+            return ', '.join(['(%s, %s, %s::integer[], %s, %s, %s::timestamptz)'] * len(answers)), [
+                param for answer in answers
+                for param in (answer.player_id, answer.question_id, answer.answer, answer.correct, answer.points,
+                              answer.answered_at)
+            ]
+
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            sql, params = values(answers)
+            cursor.execute('''
+                INSERT INTO {table} (player_id, question_id, answer, correct, points, answered_at)
+                VALUES {values}
+                ON CONFLICT (player_id, question_id) DO NOTHING
+                RETURNING id, player_id, question_id, points
+            '''.format(table=table, values=sql), params)
+            rows = cursor.fetchall()
+
+            inserted = {(player_id, question_id) for _, player_id, question_id, _ in rows}
+            existing = [answer for answer in answers if (answer.player_id, answer.question_id) not in inserted]
+            if existing:
+                sql, params = values(existing)
+                cursor.execute('''
+                    WITH new (player_id, question_id, answer, correct, points, answered_at) AS (VALUES {values}),
+                    old AS (
+                        SELECT {table}.id, {table}.points FROM {table} JOIN new USING (player_id, question_id)
+                        ORDER BY {table}.id
+                        FOR UPDATE OF {table}
+                    )
+                    UPDATE {table} SET
+                        answer = new.answer, correct = new.correct, points = new.points, answered_at = new.answered_at
+                    FROM new, old
+                    WHERE {table}.id = old.id AND
+                          {table}.player_id = new.player_id AND {table}.question_id = new.question_id
+                    RETURNING {table}.id, {table}.player_id, {table}.question_id, new.points - old.points
+                '''.format(table=table, values=sql), params)
+                rows += cursor.fetchall()
+
+        answers = {(answer.player_id, answer.question_id): answer for answer in answers}
+        deltas = {}
+        for answer_id, player_id, question_id, delta in rows:
+            answer = answers[(player_id, question_id)]
+            answer.id = answer_id
+            deltas[player_id] = deltas.get(player_id, 0) + delta
+        return deltas
+
+
 class Answer(models.Model):
     class Meta:
         verbose_name = 'Ответ игрока'
         verbose_name_plural = 'Ответы игроков'
+        unique_together = ('player', 'question')
 
     player = models.ForeignKey(Player, verbose_name='Игрок', on_delete=models.CASCADE)
     question = models.ForeignKey(GeneratedQuestion, verbose_name='Вопрос', on_delete=models.CASCADE, related_name='players_answers')
@@ -447,6 +623,8 @@ class Answer(models.Model):
     points = models.IntegerField(verbose_name='Начисленные очки за ответ', default=0)
     answered_at = models.DateTimeField(auto_now=True, verbose_name='Время ответа')
 
+    objects = AnswerManager()
+
     @property
     def answer_str(self):
         answer = list(map(lambda ans: Variant.objects.get(pk=ans).variant, self.answer))
@@ -467,3 +645,39 @@ def update_rating(instance, **kwargs):
 
     player.save()
     user.save()
+
+
+@receiver(post_save, sender=Game)
+def reset_game_state(instance, created, **kwargs):
+    from api.utils.game_state import GameState
+    if created:
+        GameState.delete(instance.pk)
+
+
+@receiver(Game.question_changed)
+@receiver(Game.check_signal)
+def update_game_state(sender, **kwargs):
+    from api.utils.game_state import GameState
+    GameState.from_game(sender).save()
+
+
+@receiver(Game.question_changed)
+def schedule_question_timer(sender, **kwargs):
+    """ Планирует переход в CHECK_STATE на дедлайн вопроса. Все таймеры хранятся в одной очереди Redis. """
+    from api.utils.scheduler import schedule
+    deadline = sender.deadline
+    if deadline is not None:
+        schedule(Game.TIMER_CHANNEL, {'game': sender.pk, 'question': sender.current_question_id},
+                 deadline - timezone.now())
+
+
+@receiver(Game.joined_player)
+def add_player_to_game_state(sender, player, **kwargs):
+    from api.utils.game_state import GameState
+    GameState.add_player(sender.pk, player.user_id, player.pk)
+
+
+@receiver(Game.finished)
+def delete_game_state(sender, **kwargs):
+    from api.utils.game_state import GameState
+    GameState.delete(sender.pk)
@@ -1,10 +1,16 @@
 import json
 import logging
+import os
 import traceback
 from datetime import datetime
+from functools import lru_cache
 
+from channels import Channel
+from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
-from django.db import models, transaction
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, connection
+from django.db.models import F
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
@@ -14,7 +20,53 @@ from api.models import User
 logger = logging.getLogger(__name__)
 
 
+DEFAULT_QUIZZES_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fixtures', 'default_quizzes.json')
+
+
+@lru_cache(maxsize=None)
+def default_quizzes():
+    """
+    Викторины по умолчанию. Файл читается один раз на процесс, результат не должен изменяться.
+    Каждая викторина проверяется отдельно: ошибочная пропускается с записью в лог, остальные создаются.
+    """
+    with open(DEFAULT_QUIZZES_FIXTURE, 'r', encoding='utf-8') as fh:
+        quizzes_data = json.load(fh)
+
+    valid_quizzes_data = []
+    for quiz_data in quizzes_data:
+        try:
+            validate_quiz_data(quiz_data)
+        except Exception:
+            logger.error('Error at adding default quiz:\n{}'.format(quiz_data))
+            logger.error(traceback.format_exc())
+        else:
+            valid_quizzes_data.append(quiz_data)
+    return valid_quizzes_data
+
+
+def validate_quiz_data(quiz_data):
+    """ Проверяет данные викторины в формате `create_quiz` без запросов к БД. """
+    quiz = Quiz(title=quiz_data['title'], description=quiz_data.get('description', ''))
+    quiz.clean_fields(exclude=('user', 'old_version'))
+    if not all(isinstance(tag, str) for tag in quiz_data.get('tags', ())):
+        raise ValidationError('Tags should be strings.')
+
+    for question_data in quiz_data.get('questions', ()):
+        variants = [variant_data['variant'] for variant_data in question_data.get('variants', ())]
+        fields = {name: value for name, value in question_data.items() if name not in ('id', 'variants', 'answer')}
+        Question(answer=question_data['answer'], **fields).clean_fields(exclude=('quiz', 'number', 'timer'))
+        for variant in variants:
+            Variant(variant=variant).clean_fields(exclude=('question',))
+
+        if len(set(variants)) < len(variants):
+            raise ValidationError('Variants should be unique per a question.')
+        if not all(1 <= position <= len(variants) for position in question_data['answer']):
+            raise ValidationError('Answer elements should be in 1..count_of_variants.')
+
+
 class QuizManager(models.Manager):
+    DEFAULT_QUIZZES_CHANNEL = 'users.default_quizzes'
+
     @transaction.atomic
     def create_quiz(self, questions=None, tags=None, **kwargs):
         quiz = self.create(**kwargs)
@@ -28,11 +80,58 @@ class QuizManager(models.Manager):
         quiz.save()
         return quiz
 
+    @transaction.atomic
+    def bulk_create_quizzes(self, quizzes_data, users):
+        """
+        Создает каждую викторину из `quizzes_data` каждому пользователю фиксированным числом запросов.
+        Данные в формате `create_quiz`, теги - объекты `Tag`; `quizzes_data` не изменяется.
+        Возвращает викторины в порядке (пользователь, викторина).
+        """
+        pairs = [(user, quiz_data) for user in users for quiz_data in quizzes_data]
+        quizzes = self.bulk_create([
+            self.model(title=quiz_data['title'], description=quiz_data.get('description', ''),
+                       rating=quiz_data.get('rating', 0), user=user)
+            for user, quiz_data in pairs
+        ])
+
+        quiz_tags = self.model.tags.through
+        quiz_tags.objects.bulk_create([
+            quiz_tags(quiz_id=quiz.pk, tag_id=tag.pk)
+            for quiz, (_, quiz_data) in zip(quizzes, pairs) for tag in quiz_data.get('tags', ())
+        ])
+
+        Question.objects.bulk_create_questions(
+            (quiz, quiz_data.get('questions', ())) for quiz, (_, quiz_data) in zip(quizzes, pairs)
+        )
+        return quizzes
+
+    def bulk_copy(self, quizzes, users):
+        """ Копирует каждую викторину каждому пользователю (см. `bulk_create_quizzes`). """
+        quizzes = self.filter(pk__in=[quiz.pk for quiz in quizzes])\
+            .prefetch_related('tags', 'questions__variants')\
+            .order_by('id')
+        return self.bulk_create_quizzes([quiz.to_data() for quiz in quizzes], users)
+
+    def create_default_quizzes(self, users):
+        """ Викторины по умолчанию из `default_quizzes.json` для пользователей одной пачкой. """
+        quizzes_data = default_quizzes()
+        tags = Tag.objects.get_or_create_tags({tag for quiz_data in quizzes_data for tag in quiz_data['tags']})
+        tags = {tag.tag: tag for tag in tags}
+        return self.bulk_create_quizzes(
+            [dict(quiz_data, tags=[tags[tag] for tag in quiz_data['tags']]) for quiz_data in quizzes_data],
+            users
+        )
+
 
 class Quiz(models.Model):
     class Meta:
         verbose_name = 'Викторина'
         verbose_name_plural = 'Викторины'
+        # Для курсорной пагинации списков викторин
+        indexes = [
+            models.Index(fields=['-rating', '-version_date', '-id']),
+            models.Index(fields=['user', '-version_date', '-id']),
+        ]
 
     title = models.CharField(verbose_name='Название', max_length=300, db_index=True)
     description = models.TextField(verbose_name='Описание', blank=True)
@@ -41,6 +140,9 @@ class Quiz(models.Model):
     rating = models.IntegerField(verbose_name='Рейтинг', default=0, db_index=True)
     version_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата версии')
     old_version = models.ForeignKey('Quiz', verbose_name='Предыдущая версия', on_delete=models.CASCADE, null=True)
+    current_version = models.ForeignKey('Quiz', verbose_name='Текущая версия', on_delete=models.CASCADE, null=True,
+                                        blank=True, related_name='archived_versions',
+                                        help_text='Заполнено у архивных версий, на которые ссылаются сыгранные игры.')
 
     objects = QuizManager()
 
@@ -49,6 +151,11 @@ class Quiz(models.Model):
         if title is description is questions is tags is None:
             return self
 
+        # Вопросы обновляются первыми: версия викторины сохраняет ее прежние название, описание и теги
+        if questions is not None:
+            self.questions_changes = self.set_questions(*questions)
+            logger.debug('Quiz %s questions changes: %s', self.pk, self.questions_changes)
+
         self.version_date = datetime.now()
 
         if title is not None:
@@ -59,88 +166,268 @@ class Quiz(models.Model):
         if tags is not None:
             self.tags.set(tags)
 
-        if questions is not None:
-            self.set_questions(*questions)
-
         self.save()
         return self
 
     def add_questions(self, *questions):
-        for number, question_data in enumerate(questions, 1):
-            variants = question_data.pop('variants', [])
-            question = Question.objects.create(number=number, quiz=self, **question_data)
-
-            # Сейчас ответ это порядковый номер в массиве вариантов его следует изменить на id варианта
-            answer_dict = {}
-
-            for var_index, variant_data in enumerate(variants, 1):
-                variant = Variant.objects.create(question=question, **variant_data)
-
-                if var_index in question.answer:
-                    answer_dict[var_index] = variant.pk
-
-            new_answer = list(map(lambda ans_key: answer_dict[ans_key], question.answer))
-            question.answer = new_answer
-            question.save()
+        Question.objects.bulk_create_questions([(self, questions)])
 
     def set_questions(self, *questions):
-        self.questions.all().delete()
-        self.add_questions(*questions)
+        """
+        Обновляет вопросы по разнице с текущими и возвращает сводку изменений.
+        Вопросы сопоставляются по `id`, если клиент его передал, иначе по номеру;
+        варианты - по тексту, а оставшиеся - по порядку.
+        Удаляются, вставляются и обновляются только изменившиеся строки, каждое действие одним запросом.
+
+        Викторина, по которой уже есть игры, на месте не изменяется (copy-on-write): ее вопросы с вариантами
+        и игры переносятся в архивную версию (см. `archive`), а в викторине вопросы создаются заново.
+        Игры и их ответы продолжают ссылаться на исходные строки вопросов и вариантов.
+        Пока по новому состоянию нет игр, следующие правки идут на месте, поэтому архивная версия
+        создается одна на каждое сыгранное состояние викторины.
+        """
+        existing = list(self.questions.prefetch_related('variants'))
+        by_id = {question.pk: question for question in existing}
+        by_number = {question.number: question for question in existing}
+        questions_data = [dict(question_data) for question_data in questions]
+        # Вопросы, которые клиент указал по id, не сопоставляются по номеру
+        claimed = {question_data.get('id') for question_data in questions_data} & by_id.keys()
+
+        matched = set()
+        created_questions, updated_questions, moved_questions, deleted_variants, updated_variants = [], [], [], [], []
+        questions_variants = []
+        for number, question_data in enumerate(questions_data, 1):
+            question_id = question_data.pop('id', None)
+            texts = [variant_data['variant'] for variant_data in question_data.pop('variants', [])]
+            positions = question_data.pop('answer', [])
+
+            if question_id is not None:
+                question = by_id.get(question_id)
+            else:
+                question = by_number.get(number)
+                if question is not None and question.pk in claimed:
+                    question = None
+            if question is not None and question.pk in matched:
+                question = None
+
+            if question is None:
+                question = Question(number=number, quiz=self, answer=[], **question_data)
+                created_questions.append(question)
+                variants, deleted, updated = match_variants([], texts)
+            else:
+                matched.add(question.pk)
+                if question.number != number:
+                    moved_questions.append(question)
+                question_data['number'] = number
+                variants, deleted, updated = match_variants(list(question.variants.all()), texts)
+                if any(getattr(question, name) != value for name, value in question_data.items()):
+                    for name, value in question_data.items():
+                        setattr(question, name, value)
+                    updated_questions.append(question)
+
+            deleted_variants += deleted
+            updated_variants += updated
+            questions_variants.append((question, variants, positions))
+
+        deleted_questions = [question.pk for question in existing if question.pk not in matched]
+        changed = any((created_questions, updated_questions, deleted_questions, deleted_variants, updated_variants))
+        for question, variants, positions in questions_variants:
+            changed = changed or any(variant.pk is None for variant in variants) or \
+                question.answer != [variants[position - 1].pk for position in positions]
+        if changed and self.game_set.exists():
+            return self.recreate_questions(questions)
+
+        if deleted_questions:
+            Question.objects.filter(pk__in=deleted_questions).delete()
+        if deleted_variants:
+            Variant.objects.filter(pk__in=[variant.pk for variant in deleted_variants]).delete()
+        if moved_questions:
+            # (quiz, number) уникальны и проверяются построчно: переставляемые вопросы сначала уходят на -number
+            Question.objects.filter(pk__in=[question.pk for question in moved_questions]).update(number=-F('number'))
+
+        Question.objects.bulk_create(created_questions)
+
+        created_variants = []
+        for question, variants, _ in questions_variants:
+            for variant in variants:
+                if variant.pk is None:
+                    variant.question = question
+                    created_variants.append(variant)
+        Variant.objects.bulk_create(created_variants)
+        Variant.objects.update_fields(updated_variants, ('variant',))
+
+        # Ответ приходит порядковыми номерами вариантов, сохраняются ID вариантов
+        created_ids = {question.pk for question in created_questions}
+        updated_ids = {question.pk for question in updated_questions}
+        changed_questions = []
+        for question, variants, positions in questions_variants:
+            answer = [variants[position - 1].pk for position in positions]
+            if question.answer != answer or question.pk in created_ids or question.pk in updated_ids:
+                question.answer = answer
+                changed_questions.append(question)
+        Question.objects.update_fields(changed_questions, ('number', 'type', 'question', 'answer', 'timer', 'points'))
+
+        return {
+            'questions_created': len(created_questions),
+            'questions_updated': len(changed_questions) - len(created_questions),
+            'questions_deleted': len(deleted_questions),
+            'questions_archived': 0,
+            'variants_created': len(created_variants),
+            'variants_updated': len(updated_variants),
+            'variants_deleted': len(deleted_variants),
+        }
+
+    def recreate_questions(self, questions):
+        """ Переносит текущие вопросы в архивную версию и создает вопросы викторины заново. """
+        version = self.archive()
+        created = Question.objects.bulk_create_questions([(self, questions)])
+        return {
+            'questions_created': len(created),
+            'questions_updated': 0,
+            'questions_deleted': 0,
+            'questions_archived': version.questions.count(),
+            'variants_created': sum(len(question_data.get('variants', ())) for question_data in questions),
+            'variants_updated': 0,
+            'variants_deleted': 0,
+        }
+
+    def archive(self):
+        """
+        Архивная версия викторины: новая строка `Quiz` с `current_version` на эту викторину, текущими названием,
+        описанием, тегами и датой версии. В нее переносятся все вопросы (вместе с вариантами) и все игры,
+        поэтому снапшот сыгранной игры показывает викторину такой, какой она была в игре.
+        """
+        version = Quiz.objects.create(title=self.title, description=self.description, user_id=self.user_id,
+                                      rating=self.rating, current_version=self)
+        # auto_now_add не дает задать дату версии при создании
+        Quiz.objects.filter(pk=version.pk).update(version_date=self.version_date)
+        version.tags.set(self.tags.all())
+        self.questions.update(quiz=version)
+        self.game_set.update(quiz=version)
+        return version
 
-    @transaction.atomic
     def copy_to_user(self, user):
-        quiz_clone = Quiz.objects.get(pk=self.pk)
-        quiz_clone.pk = None
-        quiz_clone.user = user
-        quiz_clone.save()
-
-        quiz_clone.tags.add(*self.tags.all())
-
-        for question_src in self.questions.all():
-            question_clone = Question.objects.get(pk=question_src.pk)
-            question_clone.pk = None
-            question_clone.quiz = quiz_clone
-            question_clone.save()
-
-            answer_dict = {}
-
-            for variant_src in question_src.variants.all():
-                variant_clone = Variant.objects.get(pk=variant_src.pk)
-                variant_clone.pk = None
-                variant_clone.question = question_clone
-                variant_clone.save()
-
-                if variant_src.pk in question_src.answer:
-                    answer_dict[variant_src.pk] = variant_clone.pk
-
-            question_clone.answer = list(map(lambda ans_key: answer_dict[ans_key], question_src.answer))
-            question_clone.save()
-
-        return quiz_clone
+        return Quiz.objects.bulk_copy([self], [user])[0]
+
+    def to_data(self):
+        """ Викторина в формате `create_quiz`. Теги, вопросы и их варианты должны быть предзагружены. """
+        questions = []
+        for question in self.questions.all():
+            variants = list(question.variants.all())
+            positions = {variant.pk: position for position, variant in enumerate(variants, 1)}
+            questions.append({
+                'type': question.type,
+                'question': question.question,
+                'variants': [{'variant': variant.variant} for variant in variants],
+                'answer': [positions[variant_id] for variant_id in question.answer],
+                'timer': question.timer,
+                'points': question.points,
+            })
+
+        return {
+            'title': self.title,
+            'description': self.description,
+            'rating': self.rating,
+            'tags': list(self.tags.all()),
+            'questions': questions,
+        }
 
     @staticmethod
     @receiver(post_save, sender=User)
     def add_default_quizzes(sender, instance, created, **kwargs):
-        if created:
-            try:
-                with open('api/fixtures/default_quizzes.json', 'r', encoding='utf-8') as fh:
-                    quizzes_data = json.load(fh)
-                    for quiz_data in quizzes_data:
-                        try:
-                            tags_data = quiz_data.pop('tags')
-                            tags = Tag.objects.get_or_create_tags(tags_data)
-                            Quiz.objects.create_quiz(user=instance, tags=tags, **quiz_data)
-                        except:
-                            logger.error('Error at adding default quiz:\n' + quiz_data)
-                            logger.error(traceback.format_exc())
-            except:
-                logger.error('Error at adding default quizzes.')
-                logger.error(traceback.format_exc())
+        if not created:
+            return
+
+        if settings.DEFAULT_QUIZZES_ASYNC:
+            transaction.on_commit(lambda: Channel(Quiz.objects.DEFAULT_QUIZZES_CHANNEL).send({'user': instance.pk}))
+            return
+
+        try:
+            Quiz.objects.create_default_quizzes([instance])
+        except Exception:
+            logger.error('Error at adding default quizzes.')
+            logger.error(traceback.format_exc())
 
     def __str__(self):
         return self.title
 
 
+class BulkUpdateManager(models.Manager):
+    def update_fields(self, objects, fields):
+        """ Сохраняет поля `fields` у нескольких объектов одним запросом UPDATE ... FROM (VALUES ...). """
+        if not objects:
+            return
+
+        fields = [self.model._meta.get_field(name) for name in fields]
+        row = '(%s, {})'.format(', '.join('%s::{}'.format(field.db_type(connection)) for field in fields))
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                UPDATE {table} SET {columns}
+                FROM (VALUES {values}) new_values (id, {names})
+                WHERE {table}.id = new_values.id
+            '''.format(table=self.model._meta.db_table,
+                       columns=', '.join('{0} = new_values.{0}'.format(field.column) for field in fields),
+                       names=', '.join(field.column for field in fields),
+                       values=', '.join([row] * len(objects))),
+                [param for obj in objects
+                 for param in [obj.pk] + [field.get_db_prep_value(getattr(obj, field.attname), connection)
+                                          for field in fields]])
+
+
+def match_variants(old_variants, texts):
+    """
+    Сопоставляет текущие варианты вопроса (по ID) с новыми текстами: сначала по тексту, оставшиеся - по порядку.
+    Возвращает варианты в порядке `texts` (новые не сохранены), удаляемые и переименованные варианты.
+    Если порядок сохранившихся вариантов изменился, варианты пересоздаются: порядок вариантов - это порядок ID.
+    """
+    by_text = {variant.variant: variant for variant in old_variants}
+    matched = [by_text.pop(text, None) for text in texts]
+    leftover = [variant for variant in old_variants if variant.variant in by_text]
+
+    variants, updated = [], []
+    for variant, text in zip(matched, texts):
+        if variant is None and leftover:
+            variant = leftover.pop(0)
+            variant.variant = text
+            updated.append(variant)
+        variants.append(variant if variant is not None else Variant(variant=text))
+
+    # Новые варианты получат ID больше текущих
+    ids = [variant.pk for variant in variants if variant.pk is not None]
+    if ids != sorted(ids) or any(variant.pk is not None for variant in variants[len(ids):]):
+        return [Variant(variant=text) for text in texts], old_variants, []
+    return variants, leftover, updated
+
+
+class QuestionManager(BulkUpdateManager):
+    def bulk_create_questions(self, quizzes_questions):
+        """
+        Создает вопросы викторин пачкой: [(викторина, [данные вопросов]), ...].
+        Вопросы и варианты вставляются через bulk_create,
+        ответы переписываются из порядковых номеров вариантов в их ID одним UPDATE.
+        """
+        items = [(quiz, number, question_data) for quiz, questions in quizzes_questions
+                 for number, question_data in enumerate(questions, 1)]
+        questions = self.bulk_create([
+            self.model(quiz=quiz, number=number, answer=[],
+                       **{name: value for name, value in question_data.items()
+                          if name not in ('id', 'variants', 'answer')})
+            for quiz, number, question_data in items
+        ])
+
+        questions_variants = [
+            [Variant(question=question, variant=variant_data['variant'])
+             for variant_data in question_data.get('variants', ())]
+            for question, (_, _, question_data) in zip(questions, items)
+        ]
+        Variant.objects.bulk_create([variant for variants in questions_variants for variant in variants])
+
+        # Сейчас ответ это порядковый номер в массиве вариантов его следует изменить на id варианта
+        for question, variants, (_, _, question_data) in zip(questions, questions_variants, items):
+            question.answer = [variants[position - 1].pk for position in question_data['answer']]
+        self.update_fields(questions, ('answer',))
+        return questions
+
+
 class Question(models.Model):
     quiz = models.ForeignKey(Quiz, verbose_name='Викторина', on_delete=models.CASCADE, related_name='questions')
     number = models.SmallIntegerField(verbose_name='Номер вопроса',
@@ -166,6 +453,8 @@ class Question(models.Model):
     timer = models.DurationField(null=True, verbose_name='Таймер', help_text='Таймер. Null означает, что таймера нет.')
     points = models.IntegerField(verbose_name='Очки за правильный ответ')
 
+    objects = QuestionManager()
+
     class Meta:
         verbose_name = 'Вопрос'
         verbose_name_plural = 'Вопросы'
@@ -194,13 +483,17 @@ class Variant(models.Model):
         unique_together = ('variant', 'question')
         ordering = ('id',)
 
+    objects = BulkUpdateManager()
+
     def __str__(self):
         return self.variant
 
 
 class TagManager(models.Manager):
     def get_or_create_tags(self, tags):
-        return tuple(map(lambda tag: self.get_or_create(tag=tag)[0], tags))
+        """ Теги по названиям одним запросом, недостающие создаются. """
+        existing = {tag.tag: tag for tag in self.filter(tag__in=tags)}
+        return tuple(existing[tag] if tag in existing else self.get_or_create(tag=tag)[0] for tag in tags)
 
 
 class Tag(models.Model):
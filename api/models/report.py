@@ -0,0 +1,102 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from channels import Channel
+from django.core.files import File
+from django.db import models, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.models import Game, User
+
+
+logger = logging.getLogger(__name__)
+
+
+def job_report_path(instance, filename):
+    return timezone.now().strftime('reports/%Y/%m/%d/Game_{}_%Y-%m-%d_%H-%M.xlsx').format(instance.game_id)
+
+
+class ReportJobManager(models.Manager):
+    CHANNEL = 'reports.generate'
+    # Задача, не завершившаяся за это время, считается потерянной воркером
+    STALE_TIMEOUT = timedelta(minutes=10)
+
+    def enqueue(self, game, user=None):
+        """ Ставит генерацию отчета в очередь воркера. Для игры держится не больше одной активной задачи. """
+        active = self.filter(game=game, state__in=(ReportJob.QUEUED_STATE, ReportJob.PROCESSING_STATE))
+        active.filter(created_at__lt=timezone.now() - self.STALE_TIMEOUT).update(
+            state=ReportJob.FAILED_STATE, error='Timeout', finished_at=timezone.now()
+        )
+        job = active.first()
+        if job is not None:
+            return job
+
+        job = self.create(game=game, user=user)
+        transaction.on_commit(lambda: Channel(self.CHANNEL).send({'job': job.pk}))
+        return job
+
+
+class ReportJob(models.Model):
+    class Meta:
+        verbose_name = 'Задача генерации отчета'
+        verbose_name_plural = 'Задачи генерации отчетов'
+
+    game = models.ForeignKey(Game, verbose_name='Игра', on_delete=models.CASCADE, related_name='report_jobs')
+    user = models.ForeignKey(User, verbose_name='Инициатор', on_delete=models.SET_NULL, null=True, blank=True)
+
+    QUEUED_STATE = 'queued'
+    PROCESSING_STATE = 'processing'
+    DONE_STATE = 'done'
+    FAILED_STATE = 'failed'
+    STATE_CHOICES = (
+        (QUEUED_STATE, 'В очереди'),
+        (PROCESSING_STATE, 'Генерируется'),
+        (DONE_STATE, 'Готов'),
+        (FAILED_STATE, 'Ошибка'),
+    )
+    state = models.CharField(max_length=15, verbose_name='Состояние', choices=STATE_CHOICES, default=QUEUED_STATE,
+                             db_index=True)
+    report = models.FileField(null=True, blank=True, upload_to=job_report_path, verbose_name='Отчет')
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время создания')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Время начала генерации')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Время завершения генерации')
+
+    objects = ReportJobManager()
+
+    def run(self):
+        self.state = self.PROCESSING_STATE
+        self.started_at = timezone.now()
+        self.save()
+
+        try:
+            game = self.game
+            if game.state == Game.FINISH_STATE:
+                # Отчет завершенной игры сохраняется в игре и переиспользуется
+                if not game.report_is_actual:
+                    game.save_report()
+                self.report = game.report.name
+            else:
+                with game.make_report_file() as report:
+                    self.report.save(game.report_filename, File(report), save=False)
+            self.state = self.DONE_STATE
+        except Exception:
+            logger.error('Error at generating report of game {}.'.format(self.game_id))
+            logger.error(traceback.format_exc())
+            self.state = self.FAILED_STATE
+            self.error = traceback.format_exc()
+
+        self.finished_at = timezone.now()
+        self.save()
+        return self
+
+    def __str__(self):
+        return '{} {}'.format(self.game, self.state)
+
+
+@receiver(Game.finished)
+def enqueue_finished_game_report(sender, **kwargs):
+    ReportJob.objects.enqueue(sender)
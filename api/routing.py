@@ -1,7 +1,11 @@
-from channels import route_class
+from channels import route_class, route
 from channels.generic.websockets import WebsocketDemultiplexer
 
 from api.bindings import GameBinding
+from api.consumers import generate_report, flush_answers, broadcast_progress, question_timeout, create_default_quizzes, \
+    touch_game
+from api.models import ReportJob, Game, Quiz
+from api.utils.game_state import AnswersBuffer
 
 
 class APIDemultiplexer(WebsocketDemultiplexer):
@@ -14,4 +18,10 @@ class APIDemultiplexer(WebsocketDemultiplexer):
 
 channel_routing = [
     route_class(APIDemultiplexer),
+    route(ReportJob.objects.CHANNEL, generate_report),
+    route(AnswersBuffer.CHANNEL, flush_answers),
+    route(GameBinding.PROGRESS_CHANNEL, broadcast_progress),
+    route(Game.TIMER_CHANNEL, question_timeout),
+    route(Game.TOUCH_CHANNEL, touch_game),
+    route(Quiz.objects.DEFAULT_QUIZZES_CHANNEL, create_default_quizzes),
 ]
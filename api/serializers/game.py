@@ -1,3 +1,4 @@
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError, PermissionDenied
 from rest_framework.fields import empty
@@ -5,10 +6,13 @@ from rest_framework.fields import empty
 from api.models import Game, GeneratedQuestion, Question, Player, Answer, Variant
 from api.serializers.quiz import QuizSerializer, VariantSerializer
 from api.serializers.user import UserSerializer
+from api.utils.game_state import GameState, AnswersBuffer
+from api.utils.serializers import SparseFieldsMixin
+from organization.models import Group
 from organization.serializers import OrganisationGroupSerializer
 
 
-class PlayerSerializer(serializers.ModelSerializer):
+class PlayerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
@@ -18,44 +22,69 @@ class PlayerSerializer(serializers.ModelSerializer):
 
 
 class AnswerSerializer(serializers.ModelSerializer):
+    """
+    Ответ игрока. Проверяется по горячему состоянию игры `GameState`,
+    игра загружается из БД только при сохранении ответа.
+    """
+
+    question = serializers.PrimaryKeyRelatedField(queryset=GeneratedQuestion.objects.select_related('question'),
+                                                  write_only=True)
     player = PlayerSerializer(read_only=True)
 
     class Meta:
         model = Answer
         fields = ('question', 'answer', 'player', 'correct', 'points')
-        extra_kwargs = {
-            'question': {'write_only': True},
-        }
 
-    def __init__(self, game=None, user=None, data=empty, **kwargs):
+    def __init__(self, game=None, user=None, data=empty, game_state=None, **kwargs):
         super().__init__(data=data, **kwargs)
 
         self.game = game
         self.user = user
+        self._game_state = game_state
+
+    @property
+    def game_state(self):
+        if self._game_state is None and self.game is not None:
+            self._game_state = GameState.from_game(self.game)
+        return self._game_state
 
     def create(self, validated_data):
+        if self.game is None:
+            self.game = Game.objects.get(pk=self.game_state.game_id)
         return self.game.answer(**validated_data)
 
+    def buffer(self):
+        """ Кладет ответ в буфер игры. В БД ответ сохранится пачкой через `Game.ANSWERS_BATCH_WINDOW`. """
+        question = self.validated_data['question']
+        answer = self.validated_data['answer']
+        correct = question.answer == answer
+        answered_at = timezone.now()
+
+        # Время старта и таймер уже загружены вместе с вопросом, режим подсчета очков берется из горячего состояния
+        self.instance = Answer(player=self.validated_data['player'], question=question, answer=answer,
+                               correct=correct, answered_at=answered_at,
+                               points=Game.count_points(question, correct, self.game_state.scoring, answered_at))
+        AnswersBuffer.push(self.game_state.game_id, self.instance, Game.ANSWERS_BATCH_WINDOW)
+        return self.instance
+
     def validate(self, data):
         answer = data['answer']
-        question = data['question']
 
-        variants = list(map(lambda var: var.pk, question.variants))
+        variants = self.game_state.variants
         for variant in answer:
             if variant not in variants:
                 raise ValidationError(detail='Unknown variant id "{}". It must be in {}.'.format(variant, variants),
                                       code='unknown_variant')
 
-        try:
-            player = self.game.players.get(user=self.user)
-            data['player'] = player
-        except Player.DoesNotExist:
+        player_id = self.game_state.player_id(self.user.pk)
+        if player_id is None:
             raise PermissionDenied()
+        data['player'] = Player.objects.select_related('user').get(pk=player_id)
 
         return data
 
     def validate_question(self, value):
-        if self.game.current_question != value:
+        if self.game_state.question != value.pk or not self.game_state.is_answering:
             raise ValidationError(detail='Be late.', code='be_late')
 
         return value
@@ -63,12 +92,24 @@ class AnswerSerializer(serializers.ModelSerializer):
     # FIXME: invalid docs
     def to_representation(self, instance):
         ret = super().to_representation(instance)
-        ret['answer'] = list(map(lambda var_id: VariantSerializer(Variant.objects.get(id=var_id)).data,
-                                 instance.answer))
+
+        # Варианты сериализуются один раз на кэш `context['variants']`, недостающие загружаются одним запросом
+        variants = self.context.setdefault('variants', {})
+        missing = [variant_id for variant_id in instance.answer if variant_id not in variants]
+        if missing:
+            if Answer.question.is_cached(instance) and GeneratedQuestion.question.is_cached(instance.question):
+                # Варианты вопроса могут быть предзагружены вместе с игрой
+                missing_variants = instance.question.question.variants.all()
+            else:
+                missing_variants = Variant.objects.filter(pk__in=missing)
+            for variant in missing_variants:
+                variants[variant.pk] = VariantSerializer(variant).data
+
+        ret['answer'] = [variants[variant_id] for variant_id in instance.answer if variant_id in variants]
         return ret
 
 
-class GeneratedQuestionSerializer(serializers.ModelSerializer):
+class GeneratedQuestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     question = serializers.SlugRelatedField(read_only=True, slug_field='question')
     number = serializers.IntegerField(read_only=True)
     type = serializers.ChoiceField(choices=Question.TYPE_CHOICES)
@@ -86,7 +127,7 @@ class GeneratedQuestionSerializer(serializers.ModelSerializer):
         fields = ('id', 'question', 'number', 'type', 'variants', 'answer', 'players_answers', 'timer', 'points')
 
 
-class GameSerializer(serializers.ModelSerializer):
+class GameSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     quiz = QuizSerializer()
     user = UserSerializer(read_only=True)
     players = PlayerSerializer(read_only=True, many=True)
@@ -98,16 +139,90 @@ class GameSerializer(serializers.ModelSerializer):
     class Meta:
         model = Game
         fields = ('id', 'quiz', 'label', 'user', 'players', 'group',
-                  'online', 'state', 'current_question', 'generated_questions', 'timer_on', 'timer',
+                  'online', 'scoring', 'state', 'current_question', 'generated_questions', 'timer_on', 'timer',
                   'created_at', 'updated_at', 'state_changed_at', 'finished_at')
         read_only_fields = ('user', 'players', 'state', 'current_question', 'generated_questions', 'timer',
                             'created_at', 'updated_at', 'state_changed_at', 'finished_at')
 
 
+class GameListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """ Краткое представление игры для списков. Ожидает queryset из `Game.objects.with_counts()`. """
+    quiz_title = serializers.CharField(source='quiz.title', read_only=True)
+    user = UserSerializer(read_only=True)
+    group = OrganisationGroupSerializer(read_only=True)
+    players_count = serializers.IntegerField(read_only=True)
+    questions_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Game
+        fields = ('id', 'quiz', 'quiz_title', 'label', 'user', 'group', 'online', 'scoring', 'state',
+                  'players_count', 'questions_count', 'timer_on',
+                  'created_at', 'updated_at', 'state_changed_at', 'finished_at')
+        read_only_fields = fields
+
+
+class GeneratedQuestionEventSerializer(serializers.ModelSerializer):
+    """ Текущий вопрос в событиях игры: без правильного ответа и ответов игроков. """
+
+    question = serializers.SlugRelatedField(read_only=True, slug_field='question')
+    number = serializers.IntegerField(read_only=True)
+    type = serializers.ChoiceField(choices=Question.TYPE_CHOICES)
+    variants = VariantSerializer(read_only=True, many=True)
+    timer = serializers.DurationField(read_only=True)
+    points = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = GeneratedQuestion
+        fields = ('id', 'question', 'number', 'type', 'variants', 'timer', 'points')
+
+
+class GameEventSerializer(serializers.ModelSerializer):
+    """
+    Компактное событие игры для стрима `games`.
+    Полный снапшот клиент получает один раз при подписке или через `retrieve`.
+    """
+
+    current_question = GeneratedQuestionEventSerializer(read_only=True)
+    timer = serializers.DurationField(read_only=True, help_text='Оставшиеся время.')
+
+    class Meta:
+        model = Game
+        fields = ('id', 'state', 'scoring', 'current_question', 'timer_on', 'timer',
+                  'updated_at', 'state_changed_at', 'finished_at')
+        read_only_fields = fields
+
+
+class PlayerRatingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Player
+        fields = ('id', 'rating', 'finished_at')
+        read_only_fields = fields
+
+
+class GameFinishEventSerializer(GameEventSerializer):
+    players = PlayerRatingSerializer(source='players_rating', read_only=True, many=True)
+
+    class Meta(GameEventSerializer.Meta):
+        fields = GameEventSerializer.Meta.fields + ('players',)
+        read_only_fields = fields
+
+
 class CreateGameSerializer(serializers.ModelSerializer):
     class Meta:
         model = Game
-        fields = ('quiz', 'label', 'online', 'group')
+        fields = ('quiz', 'label', 'online', 'group', 'scoring')
 
     def create(self, validated_data):
         return Game.objects.new_game(user=self.context['user'], **validated_data)
+
+
+class CreateGamesSerializer(serializers.ModelSerializer):
+    groups = serializers.PrimaryKeyRelatedField(queryset=Group.objects.all(), many=True, allow_empty=False,
+                                                help_text='Группы, в которых запускается викторина.')
+
+    class Meta:
+        model = Game
+        fields = ('quiz', 'label', 'online', 'scoring', 'groups')
+
+    def create(self, validated_data):
+        return Game.objects.new_games(user=self.context['user'], **validated_data)
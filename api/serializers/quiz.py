@@ -3,7 +3,7 @@ from rest_framework.exceptions import ValidationError
 
 from api.models import Variant, Question, Tag, Quiz
 from api.serializers.user import UserSerializer
-from api.utils.serializers import CreatableSlugRelatedField
+from api.utils.serializers import CreatableSlugRelatedField, SparseFieldsMixin
 
 
 class VariantSerializer(serializers.ModelSerializer):
@@ -12,7 +12,9 @@ class VariantSerializer(serializers.ModelSerializer):
         fields = ('id', 'variant',)
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+class QuestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # При изменении викторины по id вопрос сопоставляется с существующим
+    id = serializers.IntegerField(required=False)
     variants = VariantSerializer(many=True)
 
     class Meta:
@@ -23,6 +25,9 @@ class QuestionSerializer(serializers.ModelSerializer):
     def validate(self, attrs):
         answer = attrs.get('answer')
         variants = attrs.get('variants')
+        # При частичном обновлении викторины вопросы все равно передаются целиком
+        if answer is None or variants is None:
+            raise ValidationError(detail='Question should contain answer and variants.', code='required')
 
         for ans in answer:
             if ans > len(variants) or ans < 1:
@@ -38,7 +43,7 @@ class QuestionSerializer(serializers.ModelSerializer):
         return value
 
 
-class QuizSerializer(serializers.ModelSerializer):
+class QuizSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     tags = CreatableSlugRelatedField(many=True, queryset=Tag.objects.all(), slug_field='tag')
     user = UserSerializer(read_only=True)
     questions = QuestionSerializer(many=True)
@@ -0,0 +1,10 @@
+from rest_framework import serializers
+
+from api.models import ReportJob
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ReportJob
+        fields = ('id', 'game', 'state', 'error', 'created_at', 'started_at', 'finished_at')
+        read_only_fields = fields
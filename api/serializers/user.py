@@ -15,6 +15,16 @@ class UserSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('username', 'rating')
 
+    def to_representation(self, instance):
+        """
+        Пользователь сериализуется один раз на кэш `context['users']`.
+        Рейтинг меняется по ходу игры, поэтому всегда берется из объекта.
+        """
+        users = self.context.setdefault('users', {})
+        if instance.pk not in users:
+            users[instance.pk] = super().to_representation(instance)
+        return dict(users[instance.pk], rating=instance.rating)
+
 
 class GetUserSerializer(serializers.Serializer):
     username = serializers.CharField()
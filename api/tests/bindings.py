@@ -1,8 +1,14 @@
+from datetime import timedelta
+
+from channels.message import Message
 from channels.test import ChannelTestCase, WSClient
 
 from api.bindings import GameBinding
 from api.models import Game, User
-from api.tests.utils import ALL_FIXTURES
+from api.consumers import flush_answers, broadcast_progress, question_timeout
+from api.serializers.game import AnswerSerializer
+from api.tests.utils import ALL_FIXTURES, create_game
+from api.utils.game_state import AnswersBuffer, GameState
 
 
 class BindingsTest(ChannelTestCase):
@@ -94,3 +100,120 @@ class BindingsTest(ChannelTestCase):
         self.assertEqual(received['payload']['action'], GameBinding.ANSWER_SUB)
         self.assertEqual(received['payload']['pk'], game.pk)
         self.assertEqual(received['payload']['data']['answer'][0]['id'], answer[0])
+
+    def test_buffered_answers_subscription(self):
+        game = create_game(3, 1, answered=False)
+        game.next_question()
+        game_state = GameState.get(game.pk)
+
+        client = WSClient()
+        client.join_group(GameBinding.group_name(GameBinding.ANSWER_SUB, game.pk))
+
+        for player in game.players.select_related('user'):
+            serializer = AnswerSerializer(game_state=game_state, user=player.user, data={
+                'answer': game.current_question.answer,
+                'question': game.current_question.id
+            })
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            serializer.buffer()
+        self.assertFalse(game.current_question.players_answers.exists())
+
+        flush_answers(Message({'game': game.pk}, AnswersBuffer.CHANNEL, None))
+        self.assertEqual(game.current_question.players_answers.filter(correct=True).count(), 3)
+
+        received = client.receive()
+        self.assertEqual(received['payload']['action'], GameBinding.ANSWERS_BATCH)
+        self.assertEqual(len(received['payload']['data']), 3)
+        self.assertIsNone(client.receive())
+
+    def test_state_change_flushes_answers(self):
+        game = create_game(2, 2, answered=False)
+        game.next_question()
+        question = game.current_question
+        game_state = GameState.get(game.pk)
+
+        for player in game.players.select_related('user'):
+            serializer = AnswerSerializer(game_state=game_state, user=player.user, data={
+                'answer': question.answer,
+                'question': question.id
+            })
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            serializer.buffer()
+        self.assertFalse(question.players_answers.exists())
+
+        game.check_state()
+        self.assertEqual(question.players_answers.filter(correct=True).count(), 2)
+        self.assertEqual(AnswersBuffer.pop(game.pk), [])
+
+    def subscribe(self, user, game, action):
+        client = WSClient()
+        client.force_login(user)
+        client.send_and_consume('websocket.connect', path='/')
+        client.send_and_consume('websocket.receive', path='/', text={
+            'stream': GameBinding.stream,
+            'payload': {'action': 'subscribe', 'pk': game.pk, 'data': {'action': action}, 'request_id': 1},
+        })
+        return client.receive()['payload']
+
+    def test_answer_subscription_is_for_host_only(self):
+        game = create_game(1, 1, answered=False)
+        player = game.players.select_related('user').get()
+
+        self.assertEqual(self.subscribe(player.user, game, GameBinding.ANSWER_SUB)['response_status'], 403)
+        self.assertEqual(self.subscribe(player.user, game, GameBinding.PROGRESS_SUB)['response_status'], 200)
+        self.assertEqual(self.subscribe(game.user, game, GameBinding.ANSWER_SUB)['response_status'], 200)
+
+    def test_compact_events(self):
+        game = create_game(2, 1, answered=False)
+
+        client = WSClient()
+        client.join_group(GameBinding.group_name(GameBinding.NEXT_QUESTION_SUB, game.pk))
+        client.join_group(GameBinding.group_name(GameBinding.FINISH_SUB, game.pk))
+
+        game.next_question()
+        data = client.receive()['payload']['data']
+        self.assertEqual(data['current_question']['id'], game.current_question.pk)
+        self.assertEqual(len(data['current_question']['variants']), 2)
+        self.assertNotIn('answer', data['current_question'])
+        self.assertNotIn('generated_questions', data)
+        self.assertNotIn('players', data)
+
+        game.next_question()
+        data = client.receive()['payload']['data']
+        self.assertEqual(data['state'], Game.FINISH_STATE)
+        self.assertEqual(len(data['players']), 2)
+        self.assertNotIn('quiz', data)
+
+    def test_progress_subscription(self):
+        game = create_game(3, 1, answered=False)
+        question = game.generated_questions.get()
+
+        client = WSClient()
+        client.join_group(GameBinding.group_name(GameBinding.PROGRESS_SUB, game.pk))
+
+        for player in game.players.all()[:2]:
+            game.answer(player, question.answer, question)
+        self.assertIsNone(client.receive())
+
+        broadcast_progress(Message({'game': game.pk, 'question': question.pk}, GameBinding.PROGRESS_CHANNEL, None))
+
+        received = client.receive()
+        self.assertEqual(received['payload']['action'], GameBinding.PROGRESS_SUB)
+        self.assertEqual(received['payload']['data'], {'question': question.pk, 'answered': 2, 'players': 3})
+
+    def test_question_timeout(self):
+        game = create_game(1, 2, answered=False, timer=timedelta(seconds=20))
+        game.next_question()
+        question = game.current_question
+
+        client = WSClient()
+        client.join_group(GameBinding.group_name(GameBinding.CHECK_SUB, game.pk))
+
+        # Сообщение о таймере прошлого вопроса игнорируется
+        question_timeout(Message({'game': game.pk, 'question': question.pk + 100}, Game.TIMER_CHANNEL, None))
+        self.assertIsNone(client.receive())
+
+        question_timeout(Message({'game': game.pk, 'question': question.pk}, Game.TIMER_CHANNEL, None))
+        received = client.receive()
+        self.assertEqual(received['payload']['data']['id'], question.pk)
+        self.assertEqual(Game.objects.get(pk=game.pk).state, Game.CHECK_STATE)
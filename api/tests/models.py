@@ -1,7 +1,25 @@
-from django.test import TestCase
+import json
+import tempfile
+import zipfile
+from copy import deepcopy
+from datetime import timedelta
+from unittest import mock
 
-from api.models import Game, User
+from channels.message import Message
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.consumers import create_default_quizzes, touch_game
+from api.models import Game, User, GeneratedQuestion, Question, Quiz
+from api.models.quiz import default_quizzes
 from api.tests import ALL_FIXTURES
+from api.tests.utils import create_game
+from api.utils import scheduler
+from api.utils.game_state import get_redis
+from api.utils.reports import GroupReport
+from organization.models import Organization
 
 
 class GameModelTest(TestCase):
@@ -51,3 +69,465 @@ class GameModelTest(TestCase):
         player_answer = game.answer(player, correct_answer)
         self.assertTrue(player_answer.correct)
         self.assertEqual(player_answer.answer, correct_answer)
+
+
+class NewGameTest(TestCase):
+    def count_new_game_queries(self, questions_count):
+        quiz = create_game(0, questions_count, answered=False).quiz
+        with CaptureQueriesContext(connection) as context:
+            game = Game.objects.new_game(quiz, quiz.user)
+        self.assertEqual(game.generated_questions.count(), questions_count)
+        return len(context.captured_queries)
+
+    def test_new_game_queries_count_is_constant(self):
+        self.assertEqual(self.count_new_game_queries(2), self.count_new_game_queries(10))
+
+    def test_variants_are_shuffled_per_game(self):
+        quiz = create_game(0, 1, answered=False).quiz
+        organization = Organization.objects.create_organization('Organization', quiz.user)
+        groups = [organization.groups.create(name='Group {}'.format(i)) for i in range(2)]
+
+        games = Game.objects.new_games(quiz, quiz.user, groups + [None])
+
+        self.assertEqual([game.group for game in games], groups + [None])
+        question = quiz.questions.get()
+        variants = sorted(question.variants.values_list('id', flat=True))
+        for game in games:
+            self.assertEqual(sorted(game.generated_questions.get().variants_order), variants)
+
+
+class GeneratedQuestionTest(TestCase):
+    def test_next_is_single_query(self):
+        game = create_game(0, 3, answered=False)
+        first, second, third = game.generated_questions.order_by('number')
+        # Пропуск номера в викторине не обрывает игру
+        GeneratedQuestion.objects.filter(pk=third.pk).update(number=5)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(game.generated_questions.first_question, first)
+        with self.assertNumQueries(1):
+            self.assertEqual(second.next.pk, third.pk)
+        with self.assertRaises(GeneratedQuestion.DoesNotExist):
+            GeneratedQuestion.objects.get(pk=third.pk).next
+
+
+class GameTimerTest(TestCase):
+    def test_timer_is_remaining_time(self):
+        game = create_game(1, 1, answered=False, timer=timedelta(seconds=20))
+        game.next_question()
+        timer = game.current_question.question.timer
+
+        self.assertLessEqual(game.timer, timer)
+        self.assertGreater(game.timer, timer - timedelta(seconds=5))
+
+        game.state_changed_at -= timer * 2
+        self.assertEqual(game.timer, timedelta(0))
+
+
+class GameScoringTest(TestCase):
+    def setUp(self):
+        self.started_at = timezone.now()
+        self.question = GeneratedQuestion(started_at=self.started_at,
+                                          question=Question(points=10, timer=timedelta(seconds=20)))
+
+    def count_points(self, elapsed, scoring=Game.SPEED_SCORING, correct=True):
+        return Game.count_points(self.question, correct, scoring, self.started_at + elapsed)
+
+    def test_speed_scoring_boundaries(self):
+        self.assertEqual(self.count_points(timedelta(0)), 10)
+        self.assertEqual(self.count_points(timedelta(seconds=10)), 8)
+        self.assertEqual(self.count_points(timedelta(seconds=20)), 5)
+        # Ответ до старта и после таймера
+        self.assertEqual(self.count_points(timedelta(seconds=-1)), 10)
+        self.assertEqual(self.count_points(timedelta(seconds=21)), 5)
+        self.assertEqual(self.count_points(timedelta(seconds=1), correct=False), 0)
+
+    def test_fixed_scoring_and_no_timer(self):
+        self.assertEqual(self.count_points(timedelta(seconds=20), scoring=Game.FIXED_SCORING), 10)
+
+        self.question.question.timer = None
+        self.assertEqual(self.count_points(timedelta(seconds=20)), 10)
+
+    def test_buffered_answer_scored_by_answer_time(self):
+        game = create_game(1, 1, answered=False, timer=timedelta(seconds=20))
+        Game.objects.filter(pk=game.pk).update(scoring=Game.SPEED_SCORING)
+        game = Game.objects.get(pk=game.pk)
+        game.next_question()
+        question = game.current_question
+        player = game.players.get()
+
+        answered_at = question.started_at + timedelta(seconds=20)
+        answers = game.answer_batch([{'player': player.pk, 'question': question.pk, 'answer': question.answer,
+                                      'answered_at': answered_at.timestamp()}])
+        self.assertEqual(answers[0].points, 5)
+        self.assertEqual(answers[0].answered_at, answered_at)
+
+
+class GameAnswerTest(TestCase):
+    def test_rating_changes_by_points_delta(self):
+        game = create_game(1, 2, answered=False)
+        player = game.players.get()
+        question = game.generated_questions.first()
+        incorrect_answer = [question.question.variants.get(variant='Incorrect').pk]
+
+        game.answer(player, question.answer, question)
+        game.answer(player, question.answer, question)
+        player.refresh_from_db()
+        self.assertEqual(player.rating, 10)
+        self.assertEqual(player.user.rating, 10)
+
+        game.answer(player, incorrect_answer, question)
+        player.refresh_from_db()
+        self.assertEqual(player.rating, 0)
+        self.assertEqual(player.user.rating, 0)
+        self.assertEqual(question.players_answers.count(), 1)
+
+    def test_answer_batch(self):
+        game = create_game(3, 1, answered=False)
+        question = game.generated_questions.get()
+        incorrect_answer = [question.question.variants.get(variant='Incorrect').pk]
+        player1, player2, player3 = game.players.order_by('id')
+        game.answer(player3, question.answer, question)
+
+        answers = game.answer_batch([
+            {'player': player1.pk, 'question': question.pk, 'answer': incorrect_answer},
+            {'player': player1.pk, 'question': question.pk, 'answer': question.answer},
+            {'player': player2.pk, 'question': question.pk, 'answer': incorrect_answer},
+            {'player': player3.pk, 'question': question.pk, 'answer': incorrect_answer},
+        ])
+
+        self.assertEqual(len(answers), 3)
+        self.assertEqual(question.players_answers.count(), 3)
+        ratings = dict(game.players.values_list('id', 'rating'))
+        self.assertEqual(ratings, {player1.pk: 10, player2.pk: 0, player3.pk: 0})
+        self.assertEqual(User.objects.get(pk=player1.user_id).rating, 10)
+        self.assertEqual(User.objects.get(pk=player3.user_id).rating, 0)
+
+    def test_answers_touch_game_once_per_window(self):
+        game = create_game(2, 1, answered=False)
+        question = game.generated_questions.first()
+        player1, player2 = game.players.all()
+
+        game.answer(player1, question.answer, question)
+        updated_at = Game.objects.get(pk=game.pk).updated_at
+        self.assertGreaterEqual(updated_at, game.created_at)
+
+        game.answer(player2, question.answer, question)
+        self.assertEqual(Game.objects.get(pk=game.pk).updated_at, updated_at)
+
+        # Ответ внутри окна планирует обновление на конец окна
+        messages = [json.loads(message.decode()) for message in get_redis().zrange(scheduler.KEY, 0, -1)]
+        self.assertIn((Game.TOUCH_CHANNEL, {'game': game.pk}),
+                      [(message['channel'], message['content']) for message in messages])
+
+        touch_game(Message({'game': game.pk}, Game.TOUCH_CHANNEL, None))
+        self.assertGreater(Game.objects.get(pk=game.pk).updated_at, updated_at)
+
+
+class GameReportTest(TestCase):
+    @staticmethod
+    def count_report_queries(game):
+        game = Game.objects.select_related('group__organization').get(pk=game.pk)
+        with CaptureQueriesContext(connection) as context:
+            report = game.make_report()
+        return len(context.captured_queries), report
+
+    def test_report_queries_count_is_constant(self):
+        small_queries, small_report = self.count_report_queries(create_game(2, 2))
+        big_queries, big_report = self.count_report_queries(create_game(6, 5))
+
+        self.assertEqual(small_queries, big_queries)
+        self.assertGreater(len(big_report.getvalue()), 0)
+
+    def test_report_file(self):
+        game = create_game(3, 2)
+
+        with game.make_report_file() as report:
+            self.assertTrue(zipfile.is_zipfile(report))
+
+
+class GroupReportTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('organization_owner')
+        self.group = Organization.objects.create_organization('Organization', owner).groups.create(name='Group')
+
+    def add_game(self, players_count, questions_count):
+        game = create_game(players_count, questions_count)
+        Game.objects.filter(pk=game.pk).update(group=self.group)
+
+    def count_report_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            report = GroupReport(self.group).make_file()
+        return len(context.captured_queries), report
+
+    def test_report_queries_count_is_constant(self):
+        self.add_game(2, 2)
+        small_queries, small_report = self.count_report_queries()
+
+        self.add_game(4, 3)
+        self.add_game(3, 5)
+        big_queries, big_report = self.count_report_queries()
+
+        self.assertEqual(small_queries, big_queries)
+        self.assertTrue(zipfile.is_zipfile(big_report))
+
+
+class QuizAddQuestionsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('quiz_owner')
+
+    @staticmethod
+    def questions(count):
+        return [{
+            'type': 'sequence',
+            'question': 'Question {}'.format(number),
+            'variants': [{'variant': 'A'}, {'variant': 'B'}, {'variant': 'C'}],
+            'answer': [3, 1, 2],
+            'timer': None,
+            'points': 10,
+        } for number in range(1, count + 1)]
+
+    def test_answer_positions_become_variant_ids(self):
+        quiz = Quiz.objects.create_quiz(title='Quiz', user=self.user, questions=self.questions(3))
+
+        for number, question in enumerate(quiz.questions.order_by('number'), 1):
+            self.assertEqual(question.number, number)
+            variants = dict(question.variants.values_list('variant', 'id'))
+            self.assertEqual(question.answer, [variants['C'], variants['A'], variants['B']])
+
+    def test_queries_count_is_constant(self):
+        def count_queries(questions_count):
+            with CaptureQueriesContext(connection) as context:
+                Quiz.objects.create_quiz(title='Quiz', user=self.user, questions=self.questions(questions_count))
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(2), count_queries(20))
+
+
+class QuizSetQuestionsTest(TestCase):
+    def setUp(self):
+        self.questions = QuizAddQuestionsTest.questions(5)
+        self.quiz = Quiz.objects.create_quiz(title='Quiz', user=User.objects.create_user('quiz_owner'),
+                                             questions=deepcopy(self.questions))
+        self.ids = list(self.quiz.questions.order_by('number').values_list('id', flat=True))
+
+    def set_questions(self, questions):
+        with CaptureQueriesContext(connection) as context:
+            changes = self.quiz.set_questions(*deepcopy(questions))
+        return changes, len(context.captured_queries)
+
+    def test_unchanged_quiz_is_not_written(self):
+        changes, queries = self.set_questions(self.questions)
+        self.assertEqual(set(changes.values()), {0})
+        self.assertEqual(queries, 2)
+
+    def test_only_changed_rows_are_written(self):
+        self.questions[1]['question'] = 'Fixed typo'
+        self.questions[2]['variants'][1]['variant'] = 'B2'
+        self.questions[3]['answer'] = [1, 2, 3]
+        questions = self.questions[:4] + QuizAddQuestionsTest.questions(6)[4:]
+        questions[-1]['question'] = 'New'
+
+        changes, _ = self.set_questions(questions)
+        self.assertEqual(changes, {
+            'questions_created': 1, 'questions_updated': 2, 'questions_deleted': 0, 'questions_archived': 0,
+            'variants_created': 3, 'variants_updated': 1, 'variants_deleted': 0,
+        })
+
+        questions = list(self.quiz.questions.order_by('number'))
+        self.assertEqual([question.pk for question in questions[:5]], self.ids)
+        self.assertEqual(questions[1].question, 'Fixed typo')
+        variants = list(questions[2].variants.all())
+        self.assertEqual([variant.variant for variant in variants], ['A', 'B2', 'C'])
+        self.assertEqual(questions[2].answer, [variants[2].pk, variants[0].pk, variants[1].pk])
+        self.assertEqual(questions[3].answer, list(questions[3].variants.values_list('id', flat=True)))
+        self.assertEqual(questions[5].question, 'New')
+
+    def test_removed_questions_and_reordered_variants(self):
+        self.questions[0]['variants'].reverse()
+        self.questions[0]['answer'] = [1, 3, 2]
+
+        changes, _ = self.set_questions(self.questions[:3])
+        self.assertEqual((changes['questions_deleted'], changes['variants_deleted'], changes['variants_created']),
+                         (2, 3, 3))
+        question = self.quiz.questions.get(number=1)
+        variants = list(question.variants.all())
+        self.assertEqual([variant.variant for variant in variants], ['C', 'B', 'A'])
+        self.assertEqual(question.answer, [variants[0].pk, variants[2].pk, variants[1].pk])
+        self.assertEqual(list(self.quiz.questions.values_list('id', flat=True).order_by('number')), self.ids[:3])
+
+
+    def test_questions_matched_by_id(self):
+        questions = [dict(question_data, id=pk) for question_data, pk in zip(self.questions, self.ids)]
+        questions.reverse()
+        new_question = dict(QuizAddQuestionsTest.questions(1)[0], question='New')
+
+        changes, _ = self.set_questions([new_question] + questions)
+        self.assertEqual(changes, {
+            'questions_created': 1, 'questions_updated': 5, 'questions_deleted': 0, 'questions_archived': 0,
+            'variants_created': 3, 'variants_updated': 0, 'variants_deleted': 0,
+        })
+        questions = list(self.quiz.questions.order_by('number'))
+        self.assertEqual(questions[0].question, 'New')
+        self.assertEqual([question.pk for question in questions[1:]], self.ids[::-1])
+        self.assertEqual([question.question for question in questions[1:]],
+                         ['Question {}'.format(number) for number in range(5, 0, -1)])
+
+    def test_question_without_answer(self):
+        questions = deepcopy(self.questions)
+        del questions[0]['answer']
+        self.quiz.set_questions(*questions)
+        self.assertEqual(self.quiz.questions.get(number=1).answer, [])
+
+class QuizVersioningTest(TestCase):
+    def setUp(self):
+        self.game = create_game(1, 3, answered=False)
+        self.quiz = self.game.quiz
+        self.ids = list(self.quiz.questions.order_by('number').values_list('id', flat=True))
+        self.questions = [{
+            'type': 'single',
+            'question': 'Question {}'.format(number),
+            'variants': [{'variant': 'Correct'}, {'variant': 'Incorrect'}],
+            'answer': [1],
+            'timer': None,
+            'points': 10,
+        } for number in (1, 2, 3)]
+
+    def test_played_quiz_is_archived(self):
+        self.game.finish()
+        self.questions[1]['question'] = 'Changed'
+        self.quiz.update(title='New title', questions=self.questions[:2])
+
+        self.assertEqual(self.quiz.questions_changes['questions_archived'], 3)
+        version = self.quiz.archived_versions.get()
+        self.assertEqual(version.title, 'Quiz')
+        self.assertEqual(list(version.questions.order_by('number').values_list('id', flat=True)), self.ids)
+
+        current = list(self.quiz.questions.order_by('number'))
+        self.assertEqual([question.question for question in current], ['Question 1', 'Changed'])
+        self.assertFalse({question.pk for question in current} & set(self.ids))
+        self.assertEqual(current[1].answer, [current[1].variants.get(variant='Correct').pk])
+
+        # Завершенная игра показывает викторину такой, какой она была в игре
+        response = self.client.get('/api/games/{}/'.format(self.game.pk))
+        self.assertEqual(response.data['quiz']['id'], version.pk)
+        self.assertEqual(response.data['quiz']['title'], 'Quiz')
+        self.assertEqual([question['question'] for question in response.data['quiz']['questions']],
+                         ['Question 1', 'Question 2', 'Question 3'])
+
+        generated = self.game.generated_questions.select_related('question').order_by('number')
+        self.assertEqual([question.question_id for question in generated], self.ids)
+        self.assertEqual(generated[1].question.question, 'Question 2')
+
+        response = self.client.get('/api/quizzes/?fields=id')
+        self.assertNotIn({'id': version.pk}, response.data)
+
+    def test_version_per_played_state(self):
+        self.questions[0]['question'] = 'First edit'
+        self.quiz.update(questions=self.questions)
+        first = self.quiz.archived_versions.get()
+
+        # Пока по новому состоянию нет игр, викторина правится на месте
+        ids = list(self.quiz.questions.order_by('number').values_list('id', flat=True))
+        self.questions[0]['question'] = 'Second edit'
+        self.quiz.update(questions=self.questions)
+        self.assertEqual(self.quiz.archived_versions.count(), 1)
+        self.assertEqual(list(self.quiz.questions.order_by('number').values_list('id', flat=True)), ids)
+
+        game = Game.objects.new_game(self.quiz, self.quiz.user)
+        self.questions[0]['question'] = 'Third edit'
+        self.quiz.update(questions=self.questions)
+        first, second = self.quiz.archived_versions.order_by('id')
+        self.assertEqual(Game.objects.get(pk=self.game.pk).quiz_id, first.pk)
+        self.assertEqual(Game.objects.get(pk=game.pk).quiz_id, second.pk)
+        self.assertEqual(first.questions.get(number=1).question, 'Question 1')
+        self.assertEqual(second.questions.get(number=1).question, 'Second edit')
+        self.assertEqual(self.quiz.questions.get(number=1).question, 'Third edit')
+
+    def test_unplayed_questions_are_updated_in_place(self):
+        quiz = create_game(0, 3, answered=False).quiz
+        ids = list(quiz.questions.order_by('number').values_list('id', flat=True))
+        quiz.game_set.all().delete()
+
+        self.questions[1]['question'] = 'Changed'
+        quiz.update(questions=self.questions)
+        self.assertEqual(quiz.questions_changes['questions_archived'], 0)
+        self.assertEqual(list(quiz.questions.order_by('number').values_list('id', flat=True)), ids)
+        self.assertFalse(quiz.archived_versions.exists())
+
+    def test_unchanged_played_quiz_has_no_version(self):
+        self.quiz.update(questions=self.questions)
+        self.assertFalse(self.quiz.archived_versions.exists())
+        self.assertEqual(list(self.quiz.questions.order_by('number').values_list('id', flat=True)), self.ids)
+
+
+class QuizBulkCopyTest(TestCase):
+    def setUp(self):
+        self.quizzes = [create_game(0, count, answered=False).quiz for count in (1, 2, 3)]
+        self.users = [User.objects.create_user('copy_user_{}'.format(i)) for i in range(3)]
+
+    def test_copies_have_own_questions_and_answers(self):
+        copies = Quiz.objects.bulk_copy(self.quizzes, self.users[:2])
+        self.assertEqual([(copy.user, copy.title) for copy in copies],
+                         [(user, quiz.title) for user in self.users[:2] for quiz in self.quizzes])
+
+        for copy, quiz in zip(copies, self.quizzes * 2):
+            source = list(quiz.questions.all())
+            questions = list(copy.questions.all())
+            self.assertEqual([question.question for question in questions], [question.question for question in source])
+            for question in questions:
+                variant = question.variants.get(variant='Correct')
+                self.assertEqual(question.answer, [variant.pk])
+
+    def test_queries_count_is_constant(self):
+        def count_queries(quizzes, users):
+            with CaptureQueriesContext(connection) as context:
+                Quiz.objects.bulk_copy(quizzes, users)
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(self.quizzes[:1], self.users[:1]), count_queries(self.quizzes, self.users))
+
+
+class DefaultQuizzesTest(TestCase):
+    def test_default_quizzes_on_signup(self):
+        # Теги создаются при первой регистрации
+        User.objects.create_user('first_user')
+        with CaptureQueriesContext(connection) as context:
+            user = User.objects.create_user('new_user')
+        self.assertLess(len(context.captured_queries), 10)
+
+        quizzes_data = default_quizzes()
+        quizzes = list(Quiz.objects.filter(user=user).prefetch_related('tags', 'questions__variants').order_by('id'))
+        self.assertEqual([quiz.title for quiz in quizzes], [quiz_data['title'] for quiz_data in quizzes_data])
+        for quiz, quiz_data in zip(quizzes, quizzes_data):
+            data = quiz.to_data()
+            self.assertEqual(sorted(tag.tag for tag in data['tags']), sorted(quiz_data['tags']))
+            self.assertEqual([question['answer'] for question in data['questions']],
+                             [question['answer'] for question in quiz_data['questions']])
+
+    @override_settings(DEFAULT_QUIZZES_ASYNC=True)
+    def test_deferred_to_worker(self):
+        user = User.objects.create_user('new_user')
+        self.assertFalse(Quiz.objects.filter(user=user).exists())
+
+        create_default_quizzes(Message({'user': user.pk}, Quiz.objects.DEFAULT_QUIZZES_CHANNEL, None))
+        self.assertEqual(Quiz.objects.filter(user=user).count(), len(default_quizzes()))
+
+    def test_invalid_default_quiz_is_skipped(self):
+        quizzes_data = deepcopy(default_quizzes())
+        quizzes_data[0]['questions'][0]['answer'] = [100]
+        del quizzes_data[1]['title']
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json', encoding='utf-8') as fh:
+            json.dump(quizzes_data, fh)
+            fh.flush()
+            default_quizzes.cache_clear()
+            with mock.patch('api.models.quiz.DEFAULT_QUIZZES_FIXTURE', fh.name), \
+                    self.assertLogs('api.models.quiz', 'ERROR') as logs:
+                valid_quizzes_data = default_quizzes()
+        default_quizzes.cache_clear()
+
+        self.assertEqual(valid_quizzes_data, quizzes_data[2:])
+        self.assertEqual(len([line for line in logs.output if 'Error at adding default quiz' in line]), 2)
+        user = User.objects.create_user('new_user')
+        self.assertEqual(Quiz.objects.filter(user=user).count(), len(default_quizzes()))
@@ -1,8 +1,11 @@
 from django.test import TestCase
+from django.utils import timezone
 
 from api.models import Game
 from api.serializers.game import AnswerSerializer
 from api.tests import ALL_FIXTURES
+from api.tests.utils import create_game
+from api.utils.game_state import GameState
 
 
 class AnswerSerializerTest(TestCase):
@@ -10,6 +13,8 @@ class AnswerSerializerTest(TestCase):
 
     def test_answer_serializer(self):
         game = Game.objects.get(label='Last question')
+        # Вопрос только что запущен, таймер еще не истек
+        game.state_changed_at = timezone.now()
         user = game.players.first().user
         answer = game.current_question.answer
 
@@ -25,3 +30,63 @@ class AnswerSerializerTest(TestCase):
         self.assertEqual(player_answer.answer, answer)
         self.assertTrue(player_answer.correct)
         self.assertEqual(player_answer.question, game.current_question)
+
+
+class GameStateAnswerSerializerTest(TestCase):
+    def test_answer_validated_by_game_state(self):
+        game = create_game(2, 2, answered=False)
+        game.next_question()
+        player = game.players.first()
+
+        game_state = GameState.get(game.pk)
+        self.assertEqual(game_state.question, game.current_question.pk)
+
+        serializer = AnswerSerializer(game_state=game_state, user=player.user, data={
+            'answer': game.current_question.answer,
+            'question': game.current_question.id
+        })
+        # Вопрос и игрок по первичному ключу, без загрузки игры
+        with self.assertNumQueries(2):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+        player_answer = serializer.save()
+        self.assertTrue(player_answer.correct)
+        self.assertEqual(player_answer.player, player)
+
+    def test_finished_game_state_is_deleted(self):
+        game = create_game(1, 1, answered=False)
+        game.next_question()
+        self.assertIsNotNone(GameState.get(game.pk))
+
+        game.next_question()
+        self.assertIsNone(GameState.get(game.pk))
+
+    def test_answers_serialized_without_per_variant_queries(self):
+        game = create_game(4, 1, answered=False)
+        question = game.generated_questions.get()
+        answers = game.answer_batch([
+            {'player': player.pk, 'question': question.pk, 'answer': question.answer}
+            for player in game.players.all()
+        ])
+
+        context = {}
+        with self.assertNumQueries(1):
+            data = AnswerSerializer(instance=answers, many=True, context=context).data
+        self.assertEqual(data[0]['answer'][0]['id'], question.answer[0])
+
+        # Пользователи и варианты берутся из контекста
+        with self.assertNumQueries(0):
+            AnswerSerializer(instance=answers, many=True, context=context).data
+
+    def test_late_answer_rejected(self):
+        game = create_game(1, 1, answered=False)
+        game.next_question()
+        game.check_state()
+        player = game.players.select_related('user').get()
+
+        serializer = AnswerSerializer(game_state=GameState.get(game.pk), user=player.user, data={
+            'answer': game.current_question.answer,
+            'question': game.current_question.id
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['question'][0].code, 'be_late')
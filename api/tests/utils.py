@@ -8,3 +8,33 @@ ALL_FIXTURES = [
     'variants.json',
     'players.json'
 ]
+
+
+def create_game(players_count, questions_count, answered=True, timer=None):
+    """ Создает игру с заданным количеством игроков и вопросов, все игроки отвечают на все вопросы. """
+    from api.models import Game, Quiz, User
+
+    owner = User.objects.create_user('owner_{}_{}'.format(players_count, questions_count))
+    questions = [{
+        'type': 'single',
+        'question': 'Question {}'.format(number),
+        'variants': [{'variant': 'Correct'}, {'variant': 'Incorrect'}],
+        'answer': [1],
+        'timer': timer,
+        'points': 10,
+    } for number in range(1, questions_count + 1)]
+    quiz = Quiz.objects.create_quiz(title='Quiz', user=owner, questions=questions)
+    game = Game.objects.new_game(quiz, owner)
+
+    players = [
+        game.join(User.objects.create_user('player_{}_{}_{}'.format(players_count, questions_count, i)))
+        for i in range(players_count)
+    ]
+
+    if answered:
+        for question in game.generated_questions.all():
+            for i, player in enumerate(players):
+                answer = question.answer if i % 2 == 0 else [question.question.variants.get(variant='Incorrect').pk]
+                game.answer(player, answer, question)
+
+    return game
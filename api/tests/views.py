@@ -1,7 +1,343 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from channels.message import Message
+from channels.test import ChannelTestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.consumers import generate_report
+from api.models import ReportJob, Game, Quiz, User
+
+from api.tests.utils import create_game
+from api.utils.export import ANSWER_FIELDS
+from organization.models import Organization, GroupMember
 
 
 class SchemeTestCase(TestCase):
     def testGetScheme(self):
         response = self.client.get('/')
         self.assertEqual(response.status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class GameReportViewTest(TestCase):
+    def test_finished_game_report_is_cached(self):
+        game = create_game(2, 2)
+        game.finish()
+        self.assertTrue(game.report_jobs.exists())
+
+        url = '/media/games/{}/report/'.format(game.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        game.refresh_from_db()
+        self.assertTrue(game.report_is_actual)
+
+    def test_running_game_report(self):
+        game = create_game(2, 2)
+
+        response = self.client.get('/media/games/{}/report/'.format(game.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ReportJobViewTest(ChannelTestCase):
+    def test_report_job(self):
+        game = create_game(2, 2)
+        self.client.force_login(game.user)
+
+        response = self.client.post('/media/games/{}/report/'.format(game.pk))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['state'], ReportJob.QUEUED_STATE)
+        job_id = response.data['id']
+        job_url = '/media/reports/{}/'.format(job_id)
+
+        response = self.client.get(job_url + 'download/')
+        self.assertEqual(response.status_code, 400)
+
+        generate_report(Message({'job': job_id}, ReportJob.objects.CHANNEL, None))
+
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['state'], ReportJob.DONE_STATE)
+        self.assertIn('Game_{}_'.format(game.pk), ReportJob.objects.get(pk=job_id).report.name)
+
+        response = self.client.get(job_url + 'download/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_finished_game_report_job_survives_regeneration(self):
+        game = create_game(2, 2)
+        game.finish()
+        job = ReportJob.objects.get(game=game)
+        generate_report(Message({'job': job.pk}, ReportJob.objects.CHANNEL, None))
+
+        # Новый отчет сохраняется под другим именем
+        later = timezone.now() + timedelta(hours=1)
+        Game.objects.filter(pk=game.pk).update(updated_at=later)
+        game.refresh_from_db()
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            game.save_report()
+        self.assertNotEqual(game.report.name, ReportJob.objects.get(pk=job.pk).report.name)
+
+        self.client.force_login(game.user)
+        response = self.client.get('/media/reports/{}/download/'.format(job.pk))
+        self.assertEqual(response.status_code, 200)
+
+    def test_stale_report_job(self):
+        game = create_game(2, 2)
+        self.client.force_login(game.user)
+
+        job_id = self.client.post('/media/games/{}/report/'.format(game.pk)).data['id']
+        self.assertEqual(self.client.post('/media/games/{}/report/'.format(game.pk)).data['id'], job_id)
+
+        ReportJob.objects.filter(pk=job_id).update(
+            state=ReportJob.PROCESSING_STATE,
+            created_at=timezone.now() - ReportJob.objects.STALE_TIMEOUT - timedelta(seconds=1)
+        )
+        response = self.client.post('/media/games/{}/report/'.format(game.pk))
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.data['id'], job_id)
+        self.assertEqual(ReportJob.objects.get(pk=job_id).state, ReportJob.FAILED_STATE)
+
+
+class GameAnswersExportViewTest(TestCase):
+    def test_answers_csv(self):
+        game = create_game(2, 3)
+
+        response = self.client.get('/media/games/{}/answers/csv/'.format(game.pk))
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1 + 2 * 3)
+        self.assertEqual(lines[0], ','.join(ANSWER_FIELDS))
+
+    def test_answers_ndjson(self):
+        game = create_game(2, 3)
+
+        response = self.client.get('/media/games/{}/answers/ndjson/'.format(game.pk))
+        self.assertEqual(response.status_code, 200)
+        rows = list(map(json.loads, b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 2 * 3)
+        self.assertEqual(set(rows[0].keys()), set(ANSWER_FIELDS))
+
+
+class GamesBatchViewTest(TestCase):
+    def test_new_games_for_groups(self):
+        quiz = create_game(0, 3, answered=False).quiz
+        organization = Organization.objects.create_organization('Organization', quiz.user)
+        groups = [organization.groups.create(name='Group {}'.format(i)) for i in range(3)]
+        self.client.force_login(quiz.user)
+
+        response = self.client.post('/api/games/batch/', {
+            'quiz': quiz.pk,
+            'label': 'Test',
+            'groups': [group.pk for group in groups],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([game['group']['id'] for game in response.data], [group.pk for group in groups])
+        self.assertTrue(all(len(game['generated_questions']) == 3 for game in response.data))
+        self.assertTrue(organization.quizzes.filter(pk=quiz.pk).exists())
+
+
+class GamesListQueriesTest(TestCase):
+    def count_queries(self, group):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/groups/{}/games/'.format(group.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all('generated_questions' in game for game in response.data))
+        return len(context.captured_queries)
+
+    def test_queries_do_not_depend_on_games_size(self):
+        owner = User.objects.create_user('organization_owner')
+        group = Organization.objects.create_organization('Organization', owner).groups.create(name='Group')
+
+        Game.objects.filter(pk=create_game(2, 2).pk).update(group=group)
+        small = self.count_queries(group)
+
+        Game.objects.filter(pk__in=(create_game(5, 4).pk, create_game(3, 6).pk)).update(group=group)
+        self.assertEqual(self.count_queries(group), small)
+
+    def test_list_is_compact(self):
+        game = create_game(3, 2)
+        player = game.players.select_related('user').first()
+        self.client.force_login(player.user)
+
+        for url in ('/api/games/', '/api/games/current_player/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data, = response.data
+            self.assertEqual((data['players_count'], data['questions_count']), (3, 2))
+            self.assertEqual(data['quiz_title'], game.quiz.title)
+            self.assertNotIn('generated_questions', data)
+
+        response = self.client.get('/api/games/{}/'.format(game.pk))
+        self.assertEqual(len(response.data['generated_questions']), 2)
+
+
+class SparseFieldsViewTest(TestCase):
+    def setUp(self):
+        self.game = create_game(2, 3)
+        self.quiz = self.game.quiz
+
+    def test_fields(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/quizzes/?fields=id,title')
+        self.assertTrue(all(set(quiz) == {'id', 'title'} for quiz in response.data))
+        self.assertIn({'id': self.quiz.pk, 'title': self.quiz.title}, response.data)
+
+        response = self.client.get('/api/quizzes/{}/?fields=id,questions.number'.format(self.quiz.pk))
+        self.assertEqual(response.data['questions'], [{'number': number} for number in (1, 2, 3)])
+
+    def test_expand(self):
+        response = self.client.get('/api/quizzes/{}/?expand='.format(self.quiz.pk))
+        self.assertNotIn('questions', response.data)
+        self.assertNotIn('user', response.data)
+        self.assertIn('tags', response.data)
+
+        response = self.client.get('/api/quizzes/{}/?expand=questions'.format(self.quiz.pk))
+        self.assertEqual(len(response.data['questions'][0]['variants']), 2)
+
+    def test_game_relations_are_not_loaded(self):
+        url = '/api/games/{}/'.format(self.game.pk)
+        with self.assertNumQueries(1):
+            response = self.client.get(url + '?fields=id,state,quiz.title')
+        self.assertEqual(response.data, {'id': self.game.pk, 'state': self.game.state,
+                                         'quiz': {'title': self.quiz.title}})
+
+        response = self.client.get(url + '?fields=generated_questions.number,generated_questions.variants')
+        self.assertEqual([question['number'] for question in response.data['generated_questions']], [1, 2, 3])
+        self.assertEqual(len(response.data['generated_questions'][0]), 2)
+
+    def test_write_ignores_fields(self):
+        self.client.force_login(self.quiz.user)
+        response = self.client.patch('/api/quizzes/{}/?fields=id'.format(self.quiz.pk), {'title': 'New'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['title'], 'New')
+
+
+
+class QuizUpdateViewTest(TestCase):
+    def setUp(self):
+        self.quiz = create_game(0, 2, answered=False).quiz
+        self.quiz.game_set.all().delete()
+        self.client.force_login(self.quiz.user)
+        self.url = '/api/quizzes/{}/'.format(self.quiz.pk)
+        self.questions = self.client.get(self.url).data['questions']
+        # Ответ отдается ID вариантов, а принимается их порядковыми номерами
+        for question in self.questions:
+            positions = {variant['id']: position for position, variant in enumerate(question['variants'], 1)}
+            question['answer'] = [positions[variant_id] for variant_id in question['answer']]
+
+    def test_question_without_answer(self):
+        del self.questions[0]['answer']
+        for method in (self.client.put, self.client.patch):
+            response = method(self.url, {'title': 'Quiz', 'tags': [], 'questions': self.questions},
+                              content_type='application/json')
+            self.assertEqual(response.status_code, 400, response.data)
+
+    def test_questions_matched_by_id(self):
+        ids = [question['id'] for question in self.questions]
+        response = self.client.patch(self.url, {'questions': self.questions[::-1]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([question['id'] for question in response.data['questions']], ids[::-1])
+        self.assertEqual([question['number'] for question in response.data['questions']], [1, 2])
+
+class KeysetPaginationViewTest(TestCase):
+    def test_games_pages(self):
+        games = [create_game(0, count, answered=False) for count in (1, 2, 3)]
+        expected = [game.pk for game in sorted(games, key=lambda game: (game.created_at, game.pk), reverse=True)]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/games/?cursor=&limit=2')
+        self.assertFalse(any('COUNT(*)' in query['sql'] for query in context.captured_queries))
+        self.assertNotIn('count', response.data)
+        ids = [game['id'] for game in response.data['results']]
+
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [game['id'] for game in response.data['results']]
+        self.assertEqual([pk for pk in ids if pk in expected], expected)
+
+    def get_pages(self, url):
+        response = self.client.get(url)
+        pages = [[item['id'] for item in response.data['results']]]
+        while response.data['next'] and len(pages) < 20:
+            response = self.client.get(response.data['next'])
+            pages.append([item['id'] for item in response.data['results']])
+        return pages, response
+
+    def test_quizzes_tied_on_rating(self):
+        user = User.objects.create_user('quizzes_owner')
+        Quiz.objects.bulk_create([Quiz(title='Quiz {}'.format(i), rating=1000, user=user) for i in range(1300)])
+        quizzes = Quiz.objects.filter(user=user, rating=1000)
+        quizzes.update(version_date=timezone.now())
+        expected = list(quizzes.order_by('-id').values_list('id', flat=True))
+
+        pages, response = self.get_pages('/api/quizzes/?cursor=&limit=100&fields=id')
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual([pk for pk in ids if pk in expected], expected)
+        self.assertEqual(len(ids), len(set(ids)))
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([quiz['id'] for quiz in response.data['results']], pages[-2])
+
+        # Поля с разным направлением сортировки
+        pages, response = self.get_pages('/api/quizzes/?cursor=&limit=100&fields=id&ordering=-rating,id')
+        self.assertEqual([pk for page in pages for pk in page][:len(expected)], expected[::-1])
+
+    def test_limit_offset_by_default(self):
+        create_game(0, 1, answered=False)
+        response = self.client.get('/api/quizzes/?limit=1')
+        self.assertIn('count', response.data)
+
+
+class CopyQuizzesViewTest(TestCase):
+    def setUp(self):
+        self.quiz = create_game(0, 2, answered=False).quiz
+        self.organization = Organization.objects.create_organization('Organization', self.quiz.user)
+        self.organization.quizzes.add(self.quiz)
+        group = self.organization.groups.create(name='Group')
+        self.teachers = [User.objects.create_user('teacher_{}'.format(i)) for i in range(2)]
+        for teacher in self.teachers:
+            group.members.create(user=teacher, role=GroupMember.TEACHER_ROLE)
+        self.url = '/api/organizations/{}/quizzes/copy/'.format(self.organization.pk)
+
+    def test_copy_to_members(self):
+        self.client.force_login(self.quiz.user)
+        response = self.client.post(self.url, {
+            'quizzes': [self.quiz.pk],
+            'users': [teacher.username for teacher in self.teachers],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([copy['user'] for copy in response.data], [teacher.username for teacher in self.teachers])
+        for teacher in self.teachers:
+            self.assertEqual(Quiz.objects.get(user=teacher, title=self.quiz.title).questions.count(), 2)
+
+    def test_only_members_and_organization_quizzes(self):
+        self.client.force_login(self.quiz.user)
+        outsider = User.objects.create_user('outsider')
+        response = self.client.post(self.url, {'quizzes': [self.quiz.pk], 'users': [outsider.username]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        other_quiz = create_game(0, 1, answered=False).quiz
+        response = self.client.post(self.url, {'quizzes': [other_quiz.pk], 'users': [self.teachers[0].username]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_only(self):
+        self.client.force_login(self.teachers[0])
+        response = self.client.post(self.url, {'quizzes': [self.quiz.pk], 'users': [self.teachers[0].username]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
@@ -2,7 +2,7 @@ from django.conf.urls import url
 from django.urls import include
 from rest_framework import routers
 
-from api.views.games import GameViewSet, MediaGameViewSet
+from api.views.games import GameViewSet, MediaGameViewSet, ReportJobViewSet
 from api.views.quizzes import QuizViewSet, UserQuizzesView, CurrentUserQuizzesView
 from api.views.users import UserViewSet, SessionView, CurrentUserView, PasswordView
 
@@ -23,6 +23,7 @@ urlpatterns = [
 
 media_router = routers.DefaultRouter()
 media_router.register(r'games', MediaGameViewSet)
+media_router.register(r'reports', ReportJobViewSet)
 
 media_urlpatterns = [
     url(r'^', include(media_router.urls)),
@@ -0,0 +1,60 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api.models import Answer
+
+
+ANSWER_FIELDS = ('player', 'username', 'question', 'answer', 'correct', 'points', 'answered_at')
+CHUNK_SIZE = 2000
+
+
+def answers_rows(game):
+    """ Ответы игры построчно. Читаются серверным курсором, queryset целиком не загружается. """
+    return Answer.objects\
+        .filter(question__game=game)\
+        .order_by('id')\
+        .values_list('player_id', 'player__user__username', 'question__number',
+                     'answer', 'correct', 'points', 'answered_at')\
+        .iterator(chunk_size=CHUNK_SIZE)
+
+
+def chunked(lines, size=CHUNK_SIZE):
+    """ Склеивает строки в блоки, чтобы не отдавать клиенту каждую строку отдельной записью. """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+class Echo(object):
+    """ Псевдо-файл для csv.writer: возвращает строку вместо записи. """
+
+    def write(self, value):
+        return value
+
+
+def answers_csv(game):
+    writer = csv.writer(Echo())
+
+    def lines():
+        yield writer.writerow(ANSWER_FIELDS)
+        for player, username, question, answer, correct, points, answered_at in answers_rows(game):
+            yield writer.writerow((player, username, question, ';'.join(map(str, answer)), int(correct), points,
+                                   answered_at.isoformat()))
+
+    return chunked(lines())
+
+
+def answers_ndjson(game):
+    encoder = DjangoJSONEncoder()
+
+    def lines():
+        for row in answers_rows(game):
+            yield encoder.encode(dict(zip(ANSWER_FIELDS, row))) + '\n'
+
+    return chunked(lines())
@@ -0,0 +1,171 @@
+import json
+import time
+
+import redis
+from django.conf import settings
+
+
+_connection = None
+
+
+def get_redis():
+    global _connection
+    if _connection is None:
+        _connection = redis.StrictRedis.from_url(settings.REDIS_URL)
+    return _connection
+
+
+class GameState(object):
+    """
+    Горячее состояние запущенной игры в Redis.
+    Хранит текущий вопрос, правильный ответ, ID вариантов, дедлайн таймера и ID игроков по пользователям,
+    чтобы ответ игрока проверялся без загрузки игры из БД.
+    Обновляется по сигналам игры: смена вопроса, показ ответа, присоединение игрока и финиш.
+    """
+
+    KEY = 'keklik:game:{}:state'
+    PLAYERS_KEY = 'keklik:game:{}:players'
+    WINDOW_KEY = 'keklik:game:{}:window:{}'
+    WINDOWS = ('touch', 'touch_trailing', 'progress')
+    TTL = 24 * 60 * 60
+
+    def __init__(self, game_id, state, scoring=None, question=None, answer=None, variants=None, deadline=None):
+        self.game_id = game_id
+        self.state = state
+        self.scoring = scoring
+        self.question = question
+        self.answer = answer or []
+        self.variants = variants or []
+        self.deadline = deadline
+
+    @classmethod
+    def from_game(cls, game):
+        question = game.current_question
+        if question is None:
+            return cls(game.pk, game.state, scoring=game.scoring)
+
+        deadline = game.deadline
+        return cls(game.pk, game.state, scoring=game.scoring, question=question.pk, answer=question.answer,
+                   variants=question.variants_order, deadline=deadline.timestamp() if deadline is not None else None)
+
+    @classmethod
+    def get(cls, game_id):
+        """ Состояние из Redis или None, если игры нет в кэше. """
+        data = get_redis().hgetall(cls.KEY.format(game_id))
+        if not data:
+            return None
+
+        data = {key.decode(): json.loads(value.decode()) for key, value in data.items()}
+        return cls(game_id, **data)
+
+    @classmethod
+    def load(cls, game_id):
+        """ Состояние из Redis. При промахе собирается из БД и кэшируется. """
+        from api.models import Game
+
+        state = cls.get(game_id)
+        if state is None:
+            game = Game.objects.select_related('current_question__question').get(pk=game_id)
+            state = cls.from_game(game)
+            state.save(players=dict(game.players.values_list('user_id', 'id')))
+        return state
+
+    @property
+    def is_answering(self):
+        """ Принимаются ли ответы: игра в состоянии ответа и дедлайн вопроса не прошел. """
+        from api.models import Game
+        if self.state != Game.ANSWERING_STATE:
+            return False
+        return self.deadline is None or time.time() <= self.deadline
+
+    def save(self, players=None):
+        key = self.KEY.format(self.game_id)
+        players_key = self.PLAYERS_KEY.format(self.game_id)
+
+        pipe = get_redis().pipeline()
+        pipe.delete(key)
+        pipe.hmset(key, {
+            'state': json.dumps(self.state),
+            'scoring': json.dumps(self.scoring),
+            'question': json.dumps(self.question),
+            'answer': json.dumps(self.answer),
+            'variants': json.dumps(self.variants),
+            'deadline': json.dumps(self.deadline),
+        })
+        pipe.expire(key, self.TTL)
+        if players is not None:
+            pipe.delete(players_key)
+            if players:
+                pipe.hmset(players_key, players)
+        pipe.expire(players_key, self.TTL)
+        pipe.execute()
+
+    def player_id(self, user_id):
+        """ ID игрока пользователя в этой игре или None, если пользователь не присоединился. """
+        from api.models import Player
+
+        player_id = get_redis().hget(self.PLAYERS_KEY.format(self.game_id), user_id)
+        if player_id is not None:
+            return int(player_id)
+
+        player_id = Player.objects.filter(game_id=self.game_id, user_id=user_id).values_list('id', flat=True).first()
+        if player_id is not None:
+            self.add_player(self.game_id, user_id, player_id)
+        return player_id
+
+    @classmethod
+    def add_player(cls, game_id, user_id, player_id):
+        players_key = cls.PLAYERS_KEY.format(game_id)
+
+        pipe = get_redis().pipeline()
+        pipe.hset(players_key, user_id, player_id)
+        pipe.expire(players_key, cls.TTL)
+        pipe.execute()
+
+    @classmethod
+    def acquire_window(cls, game_id, name, window):
+        """ True только для первого вызова `name` в окне `window` (timedelta). """
+        return bool(get_redis().set(cls.WINDOW_KEY.format(game_id, name), 1, nx=True,
+                                    px=int(window.total_seconds() * 1000)))
+
+    @classmethod
+    def delete(cls, game_id):
+        get_redis().delete(cls.KEY.format(game_id), cls.PLAYERS_KEY.format(game_id),
+                           *(cls.WINDOW_KEY.format(game_id, name) for name in cls.WINDOWS))
+
+
+class AnswersBuffer(object):
+    """
+    Буфер ответов игроков в Redis.
+    Первый ответ в окне `Game.ANSWERS_BATCH_WINDOW` планирует сброс буфера,
+    все ответы окна сохраняются одной пачкой через `Game.answer_batch`.
+    """
+
+    CHANNEL = 'games.flush_answers'
+    KEY = 'keklik:game:{}:answers'
+    LOCK_KEY = 'keklik:game:{}:answers_lock'
+
+    @classmethod
+    def push(cls, game_id, answer, window):
+        from api.utils.scheduler import schedule
+
+        key = cls.KEY.format(game_id)
+        pipe = get_redis().pipeline()
+        pipe.rpush(key, json.dumps({'player': answer.player_id, 'question': answer.question_id,
+                                    'answer': answer.answer, 'answered_at': answer.answered_at.timestamp()}))
+        pipe.expire(key, GameState.TTL)
+        # Блокировка снимается при сбросе буфера, TTL нужен на случай потерянного сообщения
+        pipe.set(cls.LOCK_KEY.format(game_id), 1, nx=True, px=int(window.total_seconds() * 1000) * 10)
+        locked = pipe.execute()[-1]
+
+        if locked:
+            schedule(cls.CHANNEL, {'game': game_id}, window)
+
+    @classmethod
+    def pop(cls, game_id):
+        key = cls.KEY.format(game_id)
+        pipe = get_redis().pipeline()
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key, cls.LOCK_KEY.format(game_id))
+        answers = pipe.execute()[0]
+        return [json.loads(answer.decode()) for answer in answers]
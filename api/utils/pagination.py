@@ -0,0 +1,162 @@
+import json
+
+from django.db import connection
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+
+
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Курсорная пагинация: страница выбирается условием по полям сортировки, без OFFSET и COUNT(*).
+    Сортировка берется из `OrderingFilter` вьюсета, поля сортировки должны быть покрыты индексом.
+    В курсор попадают значения всех полей сортировки, к которым в конце добавляется `id`,
+    поэтому страницы не теряют и не повторяют записи с одинаковыми значениями первого поля.
+    """
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_unique_ordering(self.get_ordering(request, queryset, view))
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+
+        # Назад по страницам идем обратной сортировкой и разворачиваем результат
+        ordering = [self.invert(name) for name in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = self.filter_after(queryset, ordering, position)
+
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_following
+        else:
+            self.has_next, self.has_previous = has_following, position is not None
+
+        self.next_position = self.get_position(self.page[-1]) if self.page else position
+        self.previous_position = self.get_position(self.page[0]) if self.page else position
+        return self.page
+
+    @staticmethod
+    def invert(name):
+        return name[1:] if name.startswith('-') else '-' + name
+
+    @staticmethod
+    def get_unique_ordering(ordering):
+        """ Сортировка, дополненная `id` в направлении последнего поля, если `id` в ней нет. """
+        ordering = [name[:-2] + 'id' if name.lstrip('-') == 'pk' else name for name in ordering]
+        if any(name.lstrip('-') == 'id' for name in ordering):
+            return ordering
+        return ordering + ['-id' if ordering[-1].startswith('-') else 'id']
+
+    def get_position(self, instance):
+        return [field.value_to_string(instance) for field in self.fields]
+
+    def filter_after(self, queryset, ordering, position):
+        """
+        Записи после `position` в сортировке `ordering`. Подряд идущие поля с одним направлением
+        сравниваются одним сравнением строк `(a, b, c) < (%s, %s, %s)`, которое покрывается индексом.
+        """
+        try:
+            values = [field.get_db_prep_value(field.to_python(value), connection)
+                      for field, value in zip(self.fields, position)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        table = connection.ops.quote_name(queryset.model._meta.db_table)
+        columns = ['{}.{}'.format(table, connection.ops.quote_name(field.column)) for field in self.fields]
+        descending = [name.startswith('-') for name in ordering]
+
+        # Группы соседних полей с одним направлением: [(desc, [индексы полей]), ...]
+        groups = []
+        for i, desc in enumerate(descending):
+            if groups and groups[-1][0] == desc:
+                groups[-1][1].append(i)
+            else:
+                groups.append((desc, [i]))
+
+        # (g1 > p1) OR (g1 = p1 AND g2 > p2) OR ..., где каждая группа - сравнение строк
+        conditions, params = [], []
+        equal, equal_params = [], []
+        for desc, indexes in groups:
+            row = '({})'.format(', '.join(columns[i] for i in indexes))
+            placeholders = '({})'.format(', '.join(['%s'] * len(indexes)))
+            group_values = [values[i] for i in indexes]
+
+            conditions.append(' AND '.join(equal + ['{} {} {}'.format(row, '<' if desc else '>', placeholders)]))
+            params += equal_params + group_values
+            equal = equal + ['{} = {}'.format(row, placeholders)]
+            equal_params = equal_params + group_values
+
+        where = ' OR '.join('({})'.format(condition) for condition in conditions)
+        return queryset.extra(where=[where], params=params)
+
+    def decode_cursor(self, request):
+        # Пустой `?cursor=` - первая страница
+        if not request.query_params.get(self.cursor_query_param):
+            return None
+
+        cursor = super().decode_cursor(request)
+        if cursor.position is None:
+            return cursor
+
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
+
+    def encode_cursor(self, cursor):
+        if cursor.position is not None:
+            cursor = cursor._replace(position=json.dumps(cursor.position))
+        return super().encode_cursor(cursor)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(pagination.Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(pagination.Cursor(offset=0, reverse=True, position=self.previous_position))
+
+
+class CursorOrLimitOffsetPagination(pagination.LimitOffsetPagination):
+    """ Limit/offset пагинация, а с параметром `cursor` - курсорная `KeysetPagination`. """
+    cursor_class = KeysetPagination
+    cursor_query_param = cursor_class.cursor_query_param
+
+    cursor = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.cursor = self.cursor_class()
+            return self.cursor.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor is not None:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_fields(self, view):
+        cursor_fields = [field for field in self.cursor_class().get_schema_fields(view)
+                         if field.name == self.cursor_query_param]
+        return super().get_schema_fields(view) + cursor_fields
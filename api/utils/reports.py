@@ -0,0 +1,356 @@
+import io
+import tempfile
+from itertools import groupby
+
+import xlsxwriter
+from django.db.models import Count, Q, Avg
+from django.utils import timezone
+
+from api.models import Answer, Variant, Game, GeneratedQuestion, Player
+from api.utils.xlsx import XslStyles
+
+
+class XlsxReport(object):
+    def pages(self, report, styles):
+        raise NotImplementedError()
+
+    def write(self, output, constant_memory=False):
+        report = xlsxwriter.Workbook(output, {'constant_memory': constant_memory})
+        styles = XslStyles(report)
+
+        self.pages(report, styles)
+
+        report.close()
+
+    def make(self):
+        output = io.BytesIO()
+        self.write(output)
+        output.seek(0)
+        return output
+
+    def make_file(self):
+        """
+        Отчет во временном файле.
+        Книга пишется в режиме `constant_memory`, поэтому память не зависит от количества строк.
+        """
+        output = tempfile.TemporaryFile()
+        self.write(output, constant_memory=True)
+        output.seek(0)
+        return output
+
+
+class GameReport(XlsxReport):
+    """
+    XLSX отчет по игре.
+    Данные игры загружаются фиксированным числом запросов: вопросы и статистика по ним в словари,
+    игроки и их ответы потоком. Строки пишутся по порядку, что позволяет строить книгу
+    в режиме `constant_memory`.
+    """
+
+    PLAYERS_ORDERING = ('user__last_name', 'user__first_name', 'user__patronymic', 'user__username', 'id')
+
+    def __init__(self, game):
+        self.game = game
+
+        self.questions = list(game.generated_questions.select_related('question').order_by('number'))
+
+        question_ids = [question.question_id for question in self.questions]
+        self.variants = dict(Variant.objects.filter(question__in=question_ids).values_list('id', 'variant'))
+
+        self.question_success = dict.fromkeys((question.pk for question in self.questions), 0)
+        self.question_answers = dict.fromkeys((question.pk for question in self.questions), 0)
+        questions_stats = self.answers_queryset()\
+            .order_by()\
+            .values('question')\
+            .annotate(answers_count=Count('id'), success_answers_count=Count('id', filter=Q(correct=True)))
+        for stats in questions_stats:
+            self.question_answers[stats['question']] = stats['answers_count']
+            self.question_success[stats['question']] = stats['success_answers_count']
+
+        self.players_count = game.players.count()
+
+    def answers_queryset(self):
+        return Answer.objects.filter(question__game=self.game)
+
+    def players(self):
+        """ Игроки в порядке строк отчета вместе с их ответами, читаются из БД потоком. """
+        players = self.game.players\
+            .select_related('user')\
+            .annotate(success_answers_count=Count('answer', filter=Q(answer__correct=True)))\
+            .order_by(*self.PLAYERS_ORDERING)\
+            .iterator()
+        answers = self.answers_queryset()\
+            .only('player_id', 'question_id', 'answer', 'correct')\
+            .order_by(*map(lambda field: 'player__' + field, self.PLAYERS_ORDERING))\
+            .iterator()
+
+        answer = next(answers, None)
+        for player in players:
+            player_answers = {}
+            while answer is not None and answer.player_id == player.pk:
+                player_answers[answer.question_id] = answer
+                answer = next(answers, None)
+            yield player, player_answers
+
+    def pages(self, report, styles):
+        self.main_page(report, styles)
+        self.answers_page(report, styles)
+
+    def variants_str(self, variant_ids):
+        try:
+            return '; '.join(map(lambda variant_id: self.variants[variant_id], variant_ids))
+        except KeyError:
+            return 'Variant does not exist.'
+
+    def main_page(self, report, styles):
+        game = self.game
+        worksheet = report.add_worksheet('Общее')
+
+        worksheet.set_column('A:A', 30)
+        worksheet.set_column('B:B', 50)
+
+        worksheet.write('A1', 'Отчет по проведенной викторине № {} за {}'.format(
+            game.pk, game.updated_at.now().strftime('%Y-%m-%d %H:%M')), styles.title)
+        worksheet.set_row(0, 30)
+        worksheet.write('A2', game.label)
+
+        worksheet.write('A3', 'Дата:', styles.bold)
+        worksheet.write('B3', game.updated_at.now().strftime('%Y-%m-%d %H:%M'))
+
+        worksheet.write('A4', 'Организация:', styles.bold)
+        worksheet.write('B4', game.group.organization.name if game.group is not None else '-')
+
+        worksheet.write('A5', 'Группа:', styles.bold)
+        worksheet.write('B5', game.group.name if game.group is not None else '-')
+
+        worksheet.write('A7', 'Количество участников:', styles.bold)
+        players_count = self.players_count
+        worksheet.write_number('B7', players_count)
+
+        worksheet.write('A8', 'Процент правильных ответов:', styles.bold)
+        success_answers_count = sum(self.question_success.values())
+        answers_count = players_count * len(self.questions)
+        if answers_count == 0:
+            answers_count = 1
+        worksheet.write_number('B8', success_answers_count / answers_count * 100)
+
+    def answers_page(self, report, styles):
+        worksheet = report.add_worksheet('Ответы участников')
+
+        data_start_col = 3
+        player_header_row = 5
+
+        self.questions_header(worksheet, styles, data_start_col)
+        question_total_row = self.players_answers(worksheet, styles, player_header_row)
+        self.questions_total(worksheet, styles, data_start_col, question_total_row)
+
+    def questions_header(self, worksheet, styles, data_start_col):
+        question_num_row = 0
+        worksheet.write(question_num_row, 0, '№ вопроса:', styles.bold)
+        for col, question in enumerate(self.questions, data_start_col):
+            worksheet.write_number(question_num_row, col, question.number, styles.bold)
+
+        question_text_row = 1
+        worksheet.write(question_text_row, 0, 'Вопрос:', styles.bold)
+        for col, question in enumerate(self.questions, data_start_col):
+            worksheet.write(question_text_row, col, question.question.question)
+
+        variants_row = 2
+        worksheet.write(variants_row, 0, 'Варианты:', styles.bold)
+        for col, question in enumerate(self.questions, data_start_col):
+            worksheet.write(variants_row, col, self.variants_str(question.variants_order))
+
+        answer_row = 3
+        worksheet.write(answer_row, 0, 'Ответ:', styles.bold)
+        for col, question in enumerate(self.questions, data_start_col):
+            worksheet.write(answer_row, col, self.variants_str(question.question.answer))
+
+        points_row = 4
+        worksheet.write(points_row, 0, 'Макс. балл за правильный ответ:', styles.bold)
+        for col, question in enumerate(self.questions, data_start_col):
+            worksheet.write_number(points_row, col, question.question.points)
+
+        worksheet.set_column(data_start_col, data_start_col + len(self.questions) - 1, 20)
+
+    def questions_total(self, worksheet, styles, data_start_col, total_row):
+        players_count = self.players_count
+
+        success_answers_count_row = total_row
+        worksheet.write(success_answers_count_row, 0, 'Количество правильных ответов:', styles.bold)
+        for col, question in enumerate(self.questions, data_start_col):
+            worksheet.write_number(success_answers_count_row, col, self.question_success[question.pk])
+
+        answers_count_row = success_answers_count_row + 1
+        worksheet.write(answers_count_row, 0, 'Количество ответов:', styles.bold)
+        for col, question in enumerate(self.questions, data_start_col):
+            worksheet.write_number(answers_count_row, col, self.question_answers[question.pk])
+
+        success_answers_percent_row = answers_count_row + 1
+        worksheet.write(success_answers_percent_row, 0, 'Процент правильных ответов:', styles.bold)
+        for col, question in enumerate(self.questions, data_start_col):
+            success_answers_count = self.question_success[question.pk]
+            success_answers_percent = success_answers_count / players_count * 100 if players_count > 0 else 0
+            worksheet.write_number(success_answers_percent_row, col, success_answers_percent)
+
+    def players_answers(self, worksheet, styles, player_header_row):
+        questions_count = len(self.questions)
+
+        index_col = 0
+        worksheet.write(player_header_row, index_col, '№', styles.bold)
+        login_col = 1
+        worksheet.write(player_header_row, login_col, 'Логин', styles.bold)
+        name_col = 2
+        worksheet.write(player_header_row, name_col, 'ФИО', styles.bold)
+        worksheet.set_column(name_col, name_col, 30)
+        data_start_col = name_col + 1
+
+        success_answers_count_col = data_start_col + questions_count
+        worksheet.write(player_header_row, success_answers_count_col, 'Кол-во правильных ответов', styles.bold)
+        worksheet.set_column(success_answers_count_col, success_answers_count_col, 15)
+
+        success_answers_percent_col = success_answers_count_col + 1
+        worksheet.write(player_header_row, success_answers_percent_col, 'Процент правильных ответов', styles.bold)
+        worksheet.set_column(success_answers_percent_col, success_answers_percent_col, 15)
+
+        rating_col = success_answers_percent_col + 1
+        worksheet.write(player_header_row, rating_col, 'Рейтинг', styles.bold)
+
+        # Заполняю ответы
+        row = player_header_row + 1
+        for i, (player, answers) in enumerate(self.players(), 1):
+            worksheet.write_number(row, index_col, i)
+            worksheet.write(row, login_col, player.user.username)
+            worksheet.write(row, name_col, player.user.full_name)
+
+            for col, question in enumerate(self.questions, data_start_col):
+                answer = answers.get(question.pk)
+                if answer is None:
+                    worksheet.write(row, col, '-', styles.bg_gray)
+                else:
+                    style = styles.bg_green if answer.correct else styles.bg_red
+                    worksheet.write(row, col, self.variants_str(answer.answer), style)
+
+            success_answers_count = player.success_answers_count
+            worksheet.write_number(row, success_answers_count_col, success_answers_count)
+            success_answers_percent = success_answers_count / questions_count * 100 if questions_count > 0 else 0
+            worksheet.write_number(row, success_answers_percent_col, success_answers_percent)
+            worksheet.write_number(row, rating_col, player.rating)
+
+            row += 1
+
+        return row
+
+
+class GroupReport(XlsxReport):
+    """
+    Сводный XLSX отчет по всем играм группы организации.
+    Статистика считается агрегирующими запросами сразу по всем играм группы,
+    оценки игроков читаются потоком.
+    """
+
+    PLAYERS_ORDERING = ('user__last_name', 'user__first_name', 'user__patronymic', 'user__username', 'user_id')
+
+    def __init__(self, group):
+        self.group = group
+        self.games = list(group.games.select_related('quiz').order_by('created_at', 'id'))
+
+        players = Player.objects.filter(game__group=group).order_by().values('game')
+        self.players_count = dict(players.annotate(count=Count('id')).values_list('game', 'count'))
+        self.average_rating = dict(players.annotate(rating=Avg('rating')).values_list('game', 'rating'))
+
+        questions = GeneratedQuestion.objects.filter(game__group=group).order_by().values('game')
+        self.questions_count = dict(questions.annotate(count=Count('id')).values_list('game', 'count'))
+
+        answers = Answer.objects\
+            .filter(question__game__group=group)\
+            .order_by()\
+            .values('question__game')\
+            .annotate(count=Count('id', filter=Q(correct=True)))
+        self.success_answers_count = dict(answers.values_list('question__game', 'count'))
+
+    @property
+    def filename(self):
+        return 'Group_{}__{}.xlsx'.format(self.group.pk, timezone.now().strftime('%Y-%m-%d_%H-%M'))
+
+    def pages(self, report, styles):
+        self.games_page(report, styles)
+        self.ratings_page(report, styles)
+
+    @staticmethod
+    def game_title(game):
+        return '{}. {}'.format(game.pk, game.label or game.quiz.title)
+
+    def players(self):
+        """ Оценки игроков группы, сгруппированные по пользователю. """
+        players = Player.objects\
+            .filter(game__group=self.group)\
+            .order_by(*self.PLAYERS_ORDERING)\
+            .values_list('user__username', 'user__last_name', 'user__first_name', 'user__patronymic',
+                         'game_id', 'rating')\
+            .iterator()
+
+        for username, user_players in groupby(players, key=lambda player: player[0]):
+            user_players = list(user_players)
+            last_name, first_name, patronymic = user_players[0][1:4]
+            full_name = '{} {} {}'.format(last_name, first_name, patronymic)
+            yield username, full_name, {game_id: rating for *_, game_id, rating in user_players}
+
+    def games_page(self, report, styles):
+        group = self.group
+        worksheet = report.add_worksheet('Игры')
+
+        worksheet.write(0, 0, 'Отчет по группе {} организации {} за {}'.format(
+            group.name, group.organization.name, timezone.localtime().strftime('%Y-%m-%d %H:%M')), styles.title)
+        worksheet.set_row(0, 30)
+
+        header_row = 2
+        columns = ('№', 'Игра', 'Викторина', 'Дата', 'Состояние', 'Количество участников', 'Количество вопросов',
+                   'Процент правильных ответов', 'Средний рейтинг')
+        for col, title in enumerate(columns):
+            worksheet.write(header_row, col, title, styles.bold)
+        worksheet.set_column(1, 2, 30)
+        worksheet.set_column(3, len(columns) - 1, 15)
+
+        states = dict(Game.STATE_CHOICES)
+        for row, game in enumerate(self.games, header_row + 1):
+            players_count = self.players_count.get(game.pk, 0)
+            answers_count = players_count * self.questions_count.get(game.pk, 0)
+            success_answers_count = self.success_answers_count.get(game.pk, 0)
+
+            worksheet.write_number(row, 0, row - header_row)
+            worksheet.write(row, 1, self.game_title(game))
+            worksheet.write(row, 2, game.quiz.title)
+            worksheet.write(row, 3, timezone.localtime(game.created_at).strftime('%Y-%m-%d %H:%M'))
+            worksheet.write(row, 4, states.get(game.state, game.state))
+            worksheet.write_number(row, 5, players_count)
+            worksheet.write_number(row, 6, self.questions_count.get(game.pk, 0))
+            worksheet.write_number(row, 7, success_answers_count / answers_count * 100 if answers_count > 0 else 0)
+            worksheet.write_number(row, 8, self.average_rating.get(game.pk) or 0)
+
+    def ratings_page(self, report, styles):
+        worksheet = report.add_worksheet('Рейтинг участников')
+
+        header_row = 0
+        worksheet.write(header_row, 0, '№', styles.bold)
+        worksheet.write(header_row, 1, 'Логин', styles.bold)
+        worksheet.write(header_row, 2, 'ФИО', styles.bold)
+        worksheet.set_column(2, 2, 30)
+        data_start_col = 3
+        for col, game in enumerate(self.games, data_start_col):
+            worksheet.write(header_row, col, self.game_title(game), styles.bold)
+        total_col = data_start_col + len(self.games)
+        worksheet.write(header_row, total_col, 'Итого', styles.bold)
+        worksheet.set_column(data_start_col, total_col, 15)
+
+        for row, (username, full_name, ratings) in enumerate(self.players(), header_row + 1):
+            worksheet.write_number(row, 0, row - header_row)
+            worksheet.write(row, 1, username)
+            worksheet.write(row, 2, full_name)
+
+            for col, game in enumerate(self.games, data_start_col):
+                if game.pk in ratings:
+                    worksheet.write_number(row, col, ratings[game.pk])
+                else:
+                    worksheet.write(row, col, '-', styles.bg_gray)
+
+            worksheet.write_number(row, total_col, sum(ratings.values()))
@@ -0,0 +1,32 @@
+import json
+import time
+import uuid
+
+from channels import Channel
+
+from api.utils.game_state import get_redis
+
+
+KEY = 'keklik:delayed'
+
+
+def schedule(channel, content, delay):
+    """ Отправит сообщение `content` в канал `channel` через `delay` (timedelta). """
+    message = json.dumps({'id': uuid.uuid4().hex, 'channel': channel, 'content': content})
+    get_redis().zadd(KEY, time.time() + delay.total_seconds(), message)
+
+
+def due_messages(limit=100):
+    """ Сообщения, время которых наступило. Сообщение забирает только тот, кто успел удалить его из очереди. """
+    redis = get_redis()
+    for message in redis.zrangebyscore(KEY, 0, time.time(), start=0, num=limit):
+        if redis.zrem(KEY, message):
+            yield json.loads(message.decode())
+
+
+def send_due_messages():
+    count = 0
+    for message in due_messages():
+        Channel(message['channel']).send(message['content'])
+        count += 1
+    return count
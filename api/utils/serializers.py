@@ -1,6 +1,6 @@
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.encoding import smart_text
-from rest_framework import serializers
+from rest_framework import serializers, permissions
 
 
 class CreatableSlugRelatedField(serializers.SlugRelatedField):
@@ -11,3 +11,83 @@ class CreatableSlugRelatedField(serializers.SlugRelatedField):
             self.fail('does_not_exist', slug_name=self.slug_field, value=smart_text(data))
         except (TypeError, ValueError):
             self.fail('invalid')
+
+
+def parse_fields(value):
+    """ Дерево полей из списка через запятую: 'id,questions.variants' -> {'id': {}, 'questions': {'variants': {}}}. """
+    tree = {}
+    for path in value.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def get_sparse_fields(request):
+    """ Деревья параметров `fields` и `expand` запроса, None - параметр не задан. """
+    if request is None or request.method not in permissions.SAFE_METHODS:
+        return None, None
+    params = request.query_params
+    return tuple(parse_fields(params[name]) if name in params else None for name in ('fields', 'expand'))
+
+
+def nested_serializer(field):
+    """ Вложенный сериализатор поля (для many=True - его child) или None для обычного поля. """
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    return field if isinstance(field, serializers.BaseSerializer) else None
+
+
+def has_field(fields, path):
+    """ Есть ли поле `path` (вложенные через точку) среди полей сериализатора `fields`. """
+    for name in path.split('.'):
+        field = fields.get(name)
+        if field is None:
+            return False
+        serializer = nested_serializer(field)
+        fields = serializer.fields if serializer is not None else {}
+    return True
+
+
+class SparseFieldsMixin(object):
+    """
+    Выбор полей ответа параметрами GET-запроса.
+    `?fields=id,questions.question` - выводятся только перечисленные поля, поля вложенных через точку.
+    `?expand=questions` - из вложенных сериализаторов выводятся только перечисленные, обычные поля остаются.
+    Если задан `fields`, `expand` не учитывается.
+    """
+
+    # (fields, expand) для вложенного сериализатора, задается родителем
+    sparse_fields = None
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        sparse_fields = self.sparse_fields
+        if sparse_fields is None and self.is_root():
+            sparse_fields = get_sparse_fields(self.context.get('request'))
+        only, expand = sparse_fields or (None, None)
+        if only is None and expand is None:
+            return fields
+
+        for name, field in list(fields.items()):
+            serializer = nested_serializer(field)
+            if only is not None:
+                keep, sub = name in only, (only.get(name) or None, None)
+            elif expand is not None and serializer is not None:
+                keep, sub = name in expand, (None, expand.get(name) or None)
+            else:
+                keep, sub = True, None
+
+            if not keep:
+                del fields[name]
+            elif serializer is not None and isinstance(serializer, SparseFieldsMixin):
+                serializer.sparse_fields = sub
+        return fields
+
+    def is_root(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
@@ -4,6 +4,8 @@ from rest_framework import permissions, mixins
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from api.utils.serializers import has_field
+
 
 def status_text(status_code):
     return responses.get(status_code, '')
@@ -25,6 +27,28 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         return obj.user == request.user
 
 
+class SparseFieldsViewMixin(object):
+    """
+    Загружает связи только для полей, которые попадут в ответ (см. `SparseFieldsMixin`).
+    `select_related_fields` и `prefetch_related_fields`: путь поля сериализатора -> связи для загрузки.
+    """
+    select_related_fields = {}
+    prefetch_related_fields = {}
+
+    def get_sparse_queryset(self, queryset):
+        fields = self.get_serializer().fields
+        select_related = [lookup for path, lookups in self.select_related_fields.items()
+                          if has_field(fields, path) for lookup in lookups]
+        prefetch_related = [lookup for path, lookups in self.prefetch_related_fields.items()
+                            if has_field(fields, path) for lookup in lookups]
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
 class CustomGenericViewSet(GenericViewSet):
     def get_list_response(self, queryset):
         page = self.paginate_queryset(queryset)
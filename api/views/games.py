@@ -1,37 +1,55 @@
-from django.http import HttpResponse
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django_filters.rest_framework import DjangoFilterBackend
-from drf_yasg.utils import swagger_auto_schema
+from drf_yasg.utils import swagger_auto_schema, no_body
 from rest_framework import mixins, permissions, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
-from api.models import Game
-from api.serializers.game import GameSerializer, CreateGameSerializer, PlayerSerializer
-from api.utils.views import status_text, CustomGenericViewSet
+from api.models import Game, ReportJob
+from api.models.game import GameQuerySet
+from api.serializers.game import GameSerializer, CreateGameSerializer, PlayerSerializer, CreateGamesSerializer, \
+    GameListSerializer
+from api.serializers.report import ReportJobSerializer
+from api.utils.export import answers_csv, answers_ndjson
+from api.utils.pagination import CursorOrLimitOffsetPagination
+from api.utils.views import status_text, CustomGenericViewSet, SparseFieldsViewMixin
 
 
-class GameViewSet(mixins.CreateModelMixin,
+class GameViewSet(SparseFieldsViewMixin,
+                  mixins.CreateModelMixin,
                   mixins.RetrieveModelMixin,
                   mixins.ListModelMixin,
                   mixins.DestroyModelMixin,
                   CustomGenericViewSet):
-    queryset = Game.objects\
-            .select_related('quiz__user', 'user', 'group__organization', 'current_question')\
-            .prefetch_related('players__user',
-                              'quiz__tags',
-                              'quiz__questions',
-                              'generated_questions',
-                              'generated_questions__question',
-                              'generated_questions__players_answers',)
+    queryset = Game.objects.all()
+    select_related_fields = GameQuerySet.SNAPSHOT_SELECT_RELATED
+    prefetch_related_fields = GameQuerySet.SNAPSHOT_PREFETCH_RELATED
     serializer_class = GameSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    pagination_class = CursorOrLimitOffsetPagination
+
+    # Списки отдают краткое представление игр, полный снимок - только по одной игре
+    LIST_ACTIONS = ('list', 'my', 'my_running', 'current_player', 'current_player_running')
 
     filter_backends = (filters.OrderingFilter, DjangoFilterBackend)
     filter_fields = ('state',)
     ordering_fields = ('id', 'created_at', 'title')
     ordering = ('-created_at', '-id')
 
+    def get_queryset(self):
+        if self.action in self.LIST_ACTIONS:
+            return super().get_queryset().with_counts()
+        return self.get_sparse_queryset(super().get_queryset())
+
+    def get_serializer_class(self):
+        if self.action in self.LIST_ACTIONS:
+            return GameListSerializer
+        return super().get_serializer_class()
+
     @swagger_auto_schema(
         request_body=CreateGameSerializer,
         responses={
@@ -45,6 +63,22 @@ class GameViewSet(mixins.CreateModelMixin,
         game = serializer.save()
         return Response(GameSerializer(game).data, status=status.HTTP_201_CREATED)
 
+    @swagger_auto_schema(
+        request_body=CreateGamesSerializer,
+        responses={
+            status.HTTP_201_CREATED: GameSerializer(many=True),
+            status.HTTP_400_BAD_REQUEST: status_text(status.HTTP_400_BAD_REQUEST)
+        }
+    )
+    @action(detail=False, methods=['post'], permission_classes=(permissions.IsAuthenticated,))
+    def batch(self, request, *args, **kwargs):
+        """ Запуск викторины сразу для нескольких групп. """
+        serializer = CreateGamesSerializer(data=request.data, context={'user': request.user})
+        serializer.is_valid(raise_exception=True)
+        games = serializer.save()
+        games = self.get_queryset().filter(pk__in=[game.pk for game in games]).order_by('id')
+        return Response(GameSerializer(games, many=True).data, status=status.HTTP_201_CREATED)
+
     @swagger_auto_schema(
         responses={
             status.HTTP_200_OK: PlayerSerializer(many=True),
@@ -60,14 +94,7 @@ class GameViewSet(mixins.CreateModelMixin,
     @action(detail=False, permission_classes=(permissions.IsAuthenticated,))
     def my(self, request, *args, **kwargs):
         """ Созданные игры текущим пользователем (учителем). """
-        games = self.get_user_games(request.user)\
-            .select_related('quiz__user', 'user', 'group__organization', 'current_question')\
-            .prefetch_related('players__user',
-                              'quiz__tags',
-                              'quiz__questions',
-                              'generated_questions',
-                              'generated_questions__question',
-                              'generated_questions__players_answers',)
+        games = self.get_user_games(request.user)
         return self.get_list_response(games)
 
     @swagger_auto_schema(operation_id='my_running_games')
@@ -78,27 +105,13 @@ class GameViewSet(mixins.CreateModelMixin,
     )
     def my_running(self, request, *args, **kwargs):
         """ Запущенные игры текущим пользователем (учителем). """
-        games = self.get_user_games(request.user).exclude(state=Game.FINISH_STATE)\
-            .select_related('quiz__user', 'user', 'group__organization', 'current_question')\
-            .prefetch_related('players__user',
-                              'quiz__tags',
-                              'quiz__questions',
-                              'generated_questions',
-                              'generated_questions__question',
-                              'generated_questions__players_answers',)
+        games = self.get_user_games(request.user).exclude(state=Game.FINISH_STATE)
         return self.get_list_response(games)
 
     @action(detail=False, permission_classes=(permissions.IsAuthenticated,))
     def current_player(self, request, *args, **kwarg):
         """ Игры текущего игрока. """
-        games = self.get_player_games(request.user)\
-            .select_related('quiz__user', 'user', 'group__organization', 'current_question')\
-            .prefetch_related('players__user',
-                              'quiz__tags',
-                              'quiz__questions',
-                              'generated_questions',
-                              'generated_questions__question',
-                              'generated_questions__players_answers',)
+        games = self.get_player_games(request.user)
         return self.get_list_response(games)
 
     @swagger_auto_schema(operation_id='current_player_running_games')
@@ -109,14 +122,7 @@ class GameViewSet(mixins.CreateModelMixin,
     )
     def current_player_running(self, request, *args, **kwarg):
         """ Незавершенные игры текущего игрока. """
-        games = self.get_player_games(request.user).exclude(state=Game.FINISH_STATE)\
-            .select_related('quiz__user', 'user', 'group__organization', 'current_question')\
-            .prefetch_related('players__user',
-                              'quiz__tags',
-                              'quiz__questions',
-                              'generated_questions',
-                              'generated_questions__question',
-                              'generated_questions__players_answers',)
+        games = self.get_player_games(request.user).exclude(state=Game.FINISH_STATE)
         return self.get_list_response(games)
 
     def get_user_games(self, user):
@@ -126,33 +132,129 @@ class GameViewSet(mixins.CreateModelMixin,
         return self.filter_queryset(self.get_queryset().filter(players__user=user))
 
 
+def report_response(report, filename):
+    return FileResponse(
+        report,
+        as_attachment=True,
+        filename=filename,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+
+def report_last_modified(request, pk=None, **kwargs):
+    return Game.objects.filter(pk=pk, state=Game.FINISH_STATE).values_list('updated_at', flat=True).first()
+
+
+def report_etag(request, pk=None, **kwargs):
+    updated_at = report_last_modified(request, pk)
+    if updated_at is None:
+        return None
+    return '{}-{}'.format(pk, updated_at.timestamp())
+
+
 class MediaGameViewSet(GenericViewSet):
-    queryset = Game.objects\
-            .select_related('quiz__user', 'user', 'group__organization', 'current_question')\
-            .prefetch_related('players__user',
-                              'quiz__tags',
-                              'quiz__questions',
-                              'generated_questions',
-                              'generated_questions__question',
-                              'generated_questions__players_answers',)
+    queryset = Game.objects.select_related('group__organization')
     serializer_class = GameSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
     @swagger_auto_schema(
         responses={
             status.HTTP_200_OK: 'Game_1__2018-11-02_22-43.xlsx',
+            status.HTTP_304_NOT_MODIFIED: status_text(status.HTTP_304_NOT_MODIFIED),
             status.HTTP_404_NOT_FOUND: status_text(status.HTTP_404_NOT_FOUND)
         }
     )
     @action(detail=True)
+    @method_decorator(condition(etag_func=report_etag, last_modified_func=report_last_modified))
     def report(self, *args, **kwargs):
+        """
+        Отчет по игре.
+        Отчет завершенной игры генерируется один раз и отдается из MEDIA_ROOT,
+        пока игра не изменится (ETag и Last-Modified по `updated_at`).
+        """
         game = self.get_object()
-        report = game.make_report()
 
-        response = HttpResponse(
-            report,
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename=%s' % game.report_filename
+        if game.state != Game.FINISH_STATE:
+            report = game.make_report_file()
+        else:
+            if not game.report_is_actual:
+                game.save_report()
+            report = game.report.open('rb')
+
+        return report_response(report, game.report_filename)
 
+    @swagger_auto_schema(
+        request_body=no_body,
+        responses={
+            status.HTTP_202_ACCEPTED: ReportJobSerializer,
+            status.HTTP_403_FORBIDDEN: status_text(status.HTTP_403_FORBIDDEN),
+            status.HTTP_404_NOT_FOUND: status_text(status.HTTP_404_NOT_FOUND)
+        }
+    )
+    @report.mapping.post
+    def enqueue_report(self, request, *args, **kwargs):
+        """
+        Поставить генерацию отчета в очередь воркера.
+        Статус задачи: `/media/reports/{id}/`, готовый отчет: `/media/reports/{id}/download/`.
+        """
+        game = self.get_object()
+        job = ReportJob.objects.enqueue(game, request.user)
+        return Response(ReportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @swagger_auto_schema(
+        responses={
+            status.HTTP_200_OK: 'Game_1__2018-11-02_22-43.csv',
+            status.HTTP_404_NOT_FOUND: status_text(status.HTTP_404_NOT_FOUND)
+        }
+    )
+    @action(detail=True, url_path='answers/csv')
+    def answers_csv(self, *args, **kwargs):
+        """
+        Ответы игроков в CSV, одна строка на ответ:
+        `player, username, question, answer, correct, points, answered_at`.
+        """
+        game = self.get_object()
+        response = StreamingHttpResponse(answers_csv(game), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename={}.csv'.format(game.report_name)
         return response
+
+    @swagger_auto_schema(
+        responses={
+            status.HTTP_200_OK: 'Game_1__2018-11-02_22-43.ndjson',
+            status.HTTP_404_NOT_FOUND: status_text(status.HTTP_404_NOT_FOUND)
+        }
+    )
+    @action(detail=True, url_path='answers/ndjson')
+    def answers_ndjson(self, *args, **kwargs):
+        """ Ответы игроков в JSON Lines, один JSON объект на ответ (поля как в CSV). """
+        game = self.get_object()
+        response = StreamingHttpResponse(answers_ndjson(game), content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename={}.ndjson'.format(game.report_name)
+        return response
+
+
+class ReportJobViewSet(mixins.RetrieveModelMixin, GenericViewSet):
+    queryset = ReportJob.objects.select_related('game')
+    serializer_class = ReportJobSerializer
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    @swagger_auto_schema(
+        responses={
+            status.HTTP_200_OK: 'Game_1__2018-11-02_22-43.xlsx',
+            status.HTTP_400_BAD_REQUEST: 'Report is not ready.',
+            status.HTTP_404_NOT_FOUND: status_text(status.HTTP_404_NOT_FOUND)
+        }
+    )
+    @action(detail=True)
+    def download(self, *args, **kwargs):
+        """ Скачать отчет, сгенерированный задачей. """
+        job = self.get_object()
+        if job.state != ReportJob.DONE_STATE:
+            raise ValidationError(detail='Report is not ready.', code='not_ready')
+
+        try:
+            report = job.report.open('rb')
+        except FileNotFoundError:
+            raise NotFound()
+
+        return report_response(report, job.game.report_filename)
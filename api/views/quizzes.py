@@ -8,21 +8,32 @@ from rest_framework.viewsets import ModelViewSet
 
 from api.models import Quiz, User
 from api.serializers.quiz import QuizSerializer
-from api.utils.views import IsOwnerOrReadOnly
+from api.utils.pagination import CursorOrLimitOffsetPagination
+from api.utils.views import IsOwnerOrReadOnly, SparseFieldsViewMixin
 
 
-class QuizViewSet(ModelViewSet):
-    queryset = Quiz.objects\
-        .filter(old_version__isnull=True)\
-        .select_related('user')\
-        .prefetch_related('tags', 'questions__variants')
+class QuizRelatedMixin(SparseFieldsViewMixin):
+    select_related_fields = {'user': ('user',)}
+    prefetch_related_fields = {
+        'tags': ('tags',),
+        'questions': ('questions',),
+        'questions.variants': ('questions__variants',),
+    }
+
+
+class QuizViewSet(QuizRelatedMixin, ModelViewSet):
+    queryset = Quiz.objects.filter(old_version__isnull=True, current_version__isnull=True)
     serializer_class = QuizSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly)
+    pagination_class = CursorOrLimitOffsetPagination
 
     filter_backends = (filters.OrderingFilter,)
     ordering_fields = ('id', 'version_date', 'title', 'rating')
     ordering = ('-rating', '-version_date', '-id')
 
+    def get_queryset(self):
+        return self.get_sparse_queryset(super().get_queryset())
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
@@ -36,9 +47,10 @@ class QuizViewSet(ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class UserQuizzesView(ListAPIView):
+class UserQuizzesView(QuizRelatedMixin, ListAPIView):
     serializer_class = QuizSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    pagination_class = CursorOrLimitOffsetPagination
 
     filter_backends = (filters.OrderingFilter, DjangoFilterBackend)
     ordering_fields = ('id', 'version_date', 'title', 'rating')
@@ -47,10 +59,9 @@ class UserQuizzesView(ListAPIView):
     def get_queryset(self):
         username = self.kwargs['username']
         user = get_object_or_404(User, username=username)
-        return Quiz.objects\
-            .filter(user=user, old_version__isnull=True)\
-            .select_related('user')\
-            .prefetch_related('tags', 'questions__variants')
+        return self.get_sparse_queryset(
+            Quiz.objects.filter(user=user, old_version__isnull=True, current_version__isnull=True)
+        )
 
 
 class CurrentUserQuizzesView(UserQuizzesView):
@@ -59,7 +70,6 @@ class CurrentUserQuizzesView(UserQuizzesView):
 
     def get_queryset(self):
         user = self.request.user
-        return Quiz.objects\
-            .filter(user__username=user, old_version__isnull=True)\
-            .select_related('user')\
-            .prefetch_related('tags', 'questions__variants')
+        return self.get_sparse_queryset(
+            Quiz.objects.filter(user__username=user, old_version__isnull=True, current_version__isnull=True)
+        )
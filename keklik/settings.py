@@ -172,12 +172,17 @@ CSRF_TRUSTED_ORIGINS = (
 
 # Channels
 
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+
+# Викторины по умолчанию для новых пользователей создаются воркером, а не в запросе регистрации
+DEFAULT_QUIZZES_ASYNC = os.environ.get('KEKLIK_DEFAULT_QUIZZES_ASYNC', '').lower() in ('1', 'true', 'yes')
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "asgi_redis.core.RedisChannelLayer",
         "ROUTING": "keklik.routing.channel_routing",
         "CONFIG": {
-            "hosts": [os.environ.get('REDIS_URL', 'redis://localhost:6379')],
+            "hosts": [REDIS_URL],
         },
     },
 }
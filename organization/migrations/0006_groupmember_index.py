@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0005_auto_20181105_1655'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='groupmember',
+            index=models.Index(fields=['group', '-id'], name='organizatio_group_i_12729e_idx'),
+        ),
+    ]
@@ -76,6 +76,9 @@ class GroupMember(models.Model):
         verbose_name = 'Член группы организации'
         verbose_name_plural = 'Члены групп организаций'
         unique_together = ('group', 'user', 'role')
+        indexes = [
+            models.Index(fields=['group', '-id']),
+        ]
 
     @property
     def organization(self):
@@ -1,8 +1,10 @@
+from django.db.models import Q
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from api.models import User, Quiz
 from api.serializers.user import UserSerializer, GetUserSerializer
+from api.utils.serializers import SparseFieldsMixin
 from organization.models import Organization, Group, Admin, GroupMember
 
 
@@ -25,7 +27,7 @@ class GroupMemberSerializer(serializers.ModelSerializer):
         return GroupMember.objects.create(group=self.context['group'], **validated_data)
 
 
-class GroupSerializer(serializers.ModelSerializer):
+class GroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     members = GroupMemberSerializer(many=True, read_only=True)
 
     class Meta:
@@ -69,7 +71,7 @@ class DeleteAdminSerializer(serializers.Serializer):
         self.admin.delete()
 
 
-class AdminSerializer(serializers.ModelSerializer):
+class AdminSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer()
 
     class Meta:
@@ -77,7 +79,7 @@ class AdminSerializer(serializers.ModelSerializer):
         fields = ('user', 'created_at')
 
 
-class OrganizationDetailSerializer(serializers.ModelSerializer):
+class OrganizationDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     admins = AdminSerializer(many=True, read_only=True)
     groups = GroupSerializer(many=True, read_only=True)
 
@@ -134,3 +136,39 @@ class RemoveQuizFromOrganization(serializers.Serializer):
         quiz = self.validated_data['quiz']
         orgainization = self.context['organization']
         orgainization.quizzes.remove(quiz)
+
+
+class CopyQuizzesSerializer(serializers.Serializer):
+    """ Копирование викторин из базы организации ее членам: каждая викторина каждому пользователю. """
+    quizzes = serializers.ListField(child=serializers.IntegerField(), allow_empty=False,
+                                    help_text='ID викторин базы организации')
+    users = serializers.ListField(child=serializers.CharField(), allow_empty=False,
+                                  help_text='Usernames членов групп или админов организации')
+
+    def validate_quizzes(self, value):
+        organization = self.context['organization']
+        quizzes = list(organization.quizzes.filter(pk__in=value))
+        if len(quizzes) != len(set(value)):
+            raise ValidationError('Quizzes should be in the organization.', code='not_found')
+        return quizzes
+
+    def validate_users(self, value):
+        organization = self.context['organization']
+        users = list(User.objects
+                     .filter(username__in=value)
+                     .filter(Q(member_of_groups__group__organization=organization) | Q(admin__organization=organization))
+                     .distinct())
+        if len(users) != len(set(value)):
+            raise ValidationError('Users should be members of the organization.', code='not_found')
+        return users
+
+    def save(self, **kwargs):
+        return Quiz.objects.bulk_copy(self.validated_data['quizzes'], self.validated_data['users'])
+
+
+class QuizCopySerializer(serializers.ModelSerializer):
+    user = serializers.SlugRelatedField(slug_field='username', read_only=True)
+
+    class Meta:
+        model = Quiz
+        fields = ('id', 'title', 'user')
@@ -7,10 +7,14 @@ from rest_framework.viewsets import GenericViewSet
 from api.models import Game
 from api.serializers.game import GameSerializer
 from api.serializers.quiz import QuizSerializer
-from api.utils.views import status_text, CustomModelViewSet, CustomGenericViewSet
+from api.views.games import report_response
+from api.utils.pagination import CursorOrLimitOffsetPagination
+from api.utils.reports import GroupReport
+from api.utils.views import status_text, CustomModelViewSet, CustomGenericViewSet, SparseFieldsViewMixin
 from organization.models import Organization, Group, GroupMember
 from organization.serializers import OrganizationDetailSerializer, GroupSerializer, AdminSerializer, AddAdminSerializer, \
-    DeleteAdminSerializer, GroupMemberSerializer, AddQuizToOrganization, RemoveQuizFromOrganization
+    DeleteAdminSerializer, GroupMemberSerializer, AddQuizToOrganization, RemoveQuizFromOrganization, \
+    CopyQuizzesSerializer, QuizCopySerializer
 
 
 class IsOrganizationAdminOrReadOnly(permissions.BasePermission):
@@ -35,10 +39,18 @@ class IsOrganizationAdminOrTeacherOrReadOnly(IsOrganizationAdminOrReadOnly):
         return organization.groups.filter(members__user=request.user, members__role=GroupMember.TEACHER_ROLE).exists()
 
 
-class OrganizationViewSet(CustomModelViewSet):
+class OrganizationViewSet(SparseFieldsViewMixin, CustomModelViewSet):
     queryset = Organization.objects.all()
     serializer_class = OrganizationDetailSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, IsOrganizationAdminOrReadOnly)
+    prefetch_related_fields = {
+        'admins': ('admins__user',),
+        'groups': ('groups',),
+        'groups.members': ('groups__members__user',),
+    }
+
+    def get_queryset(self):
+        return self.get_sparse_queryset(super().get_queryset())
 
     @swagger_auto_schema(
         responses={
@@ -157,6 +169,28 @@ class OrganizationViewSet(CustomModelViewSet):
         serializer.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @swagger_auto_schema(
+        request_body=CopyQuizzesSerializer,
+        responses={
+            status.HTTP_201_CREATED: QuizCopySerializer(many=True),
+            status.HTTP_400_BAD_REQUEST: status_text(status.HTTP_400_BAD_REQUEST),
+            status.HTTP_403_FORBIDDEN: status_text(status.HTTP_403_FORBIDDEN),
+            status.HTTP_404_NOT_FOUND: 'Organization not found.'
+        }
+    )
+    @action(
+        detail=True,
+        methods=['post'],
+        url_path='quizzes/copy',
+        permission_classes=(permissions.IsAuthenticated, IsOrganizationAdminOrReadOnly)
+    )
+    def copy_quizzes(self, request, *args, **kwargs):
+        """ Скопировать викторины из базы организации ее членам. """
+        serializer = CopyQuizzesSerializer(data=request.data, context={'organization': self.get_object()})
+        serializer.is_valid(raise_exception=True)
+        copies = serializer.save()
+        return Response(QuizCopySerializer(copies, many=True).data, status=status.HTTP_201_CREATED)
+
 
 class GroupViewSet(mixins.RetrieveModelMixin,
                    mixins.UpdateModelMixin,
@@ -166,6 +200,7 @@ class GroupViewSet(mixins.RetrieveModelMixin,
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, IsOrganizationAdminOrReadOnly)
+    pagination_class = CursorOrLimitOffsetPagination
 
     @swagger_auto_schema(
         responses={
@@ -206,7 +241,7 @@ class GroupViewSet(mixins.RetrieveModelMixin,
     def games(self, *args, **kwarg):
         """ История проведенных игр опубликованные в этой группе. """
         group = self.get_object()
-        games = group.games.all().order_by('-id')
+        games = group.games.with_snapshot().order_by('-id')
         return self.get_list_response(games)
 
     @swagger_auto_schema(
@@ -219,9 +254,24 @@ class GroupViewSet(mixins.RetrieveModelMixin,
     def running_games(self, *args, **kwarg):
         """ Запущенные игры в этой группе. """
         group = self.get_object()
-        games = group.games.exclude(state=Game.FINISH_STATE).order_by('-id')
+        games = group.games.exclude(state=Game.FINISH_STATE).with_snapshot().order_by('-id')
         return Response(GameSerializer(games, many=True).data)
 
+    @swagger_auto_schema(
+        responses={
+            status.HTTP_200_OK: 'Group_1__2018-11-02_22-43.xlsx',
+            status.HTTP_404_NOT_FOUND: 'Group not found.'
+        }
+    )
+    @action(detail=True)
+    def report(self, *args, **kwargs):
+        """
+        Сводный отчет по всем играм группы.
+        Лист со статистикой игр и лист с рейтингом участников по каждой игре.
+        """
+        report = GroupReport(self.get_object())
+        return report_response(report.make_file(), report.filename)
+
 
 class GroupMemberViewSet(mixins.RetrieveModelMixin,
                          mixins.DestroyModelMixin,
@@ -4,4 +4,6 @@ stdout=logs/keklik_api.log
 stderr=logs/keklik_api_err.log
 
 daphne keklik.asgi:channel_layer -b 0.0.0.0 -p 8000 -v2 >> ${stdout} 2>> ${stderr} &
-python3 manage.py runworker -v2 >> ${stdout} 2>> ${stderr} &
+python3 manage.py runworker -v2 --exclude-channels=reports.generate >> ${stdout} 2>> ${stderr} &
+python3 manage.py runworker -v2 --only-channels=reports.generate >> ${stdout} 2>> ${stderr} &
+python3 manage.py rundelayed >> ${stdout} 2>> ${stderr} &